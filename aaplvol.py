@@ -1,4 +1,4 @@
-import math, numpy as np, pandas as pd, blackscholes as bs, datetime, matplotlib
+import math, numpy as np, pandas as pd, blackscholes as bs, datetime, matplotlib, intraday, prefilter
 from iexfinance.stocks import Stock, get_historical_data
 
 # Getting the data 
@@ -43,15 +43,9 @@ tbills = pd.read_csv('tbills.csv').set_index('DATE') # from the Treasury.gov web
 dtp = None
 
 if input('Pull new options data from CSV? (y/n)\n') == 'y':
-  df = pd.read_csv('aaplvol.csv',low_memory=False)
-  print('file opened...')
-  datetime = df['Date-Time'].apply(pd.Timestamp)
-  price = (df['Bid Price'] + df['Ask Price'])/2 # we assume the fair price is the midpoint
-  dtp = pd.DataFrame({'Date-Time':datetime.apply(pd.Timestamp),'Price':price})
-  print('dataframe formatted...')
-  dtp = dtp.set_index('Date-Time').resample('6h').mean().dropna()
+  dtp = intraday.load('aaplvol.csv','6h') # we assume the fair price is the midpoint
   dtp.to_csv('dtp.csv')
-  print('index set and dates resampled. file saved.')
+  print('file streamed and dates resampled. file saved.')
 else:
   dtp = pd.read_csv('dtp.csv').set_index('Date-Time')
 
@@ -60,17 +54,23 @@ else:
 bsout = []
 dateout = []
 
+def impliedvol(s,r,t,p):
+  '''implied vol of the 60 strike call, nan if the price is outside the
+     no-arbitrage bounds or the solver does not converge
+  '''
+  if prefilter.check(p,s,60,iexq,r,t,True) != prefilter.OK:
+    return np.nan
+  vol, status, iters = bs.bsvolbatch(p,s,60,iexq,r,t,True,x0=0.1,e=0.0001)
+  return float(vol) if status == bs.CONVERGED else np.nan
+
 for open, close, date in zip(iex_price['open'],iex_price['close'],iex_price['Unnamed: 0']):
   dateout += [date,date]
-  bsout += [bs.nrtest(bs.bsvol,0.1,0.0001,(open,60,iexq,
-          0.01*tbills['4 WEEKS BANK DISCOUNT'].get(date,0.07),
-          ((datetime.datetime(2020,12,11) - datetime.datetime.strptime(date,'%Y-%m-%d')).days/365),
-          30+dtp['Price'][date+' 12:00:00+00:00'])), bs.nrtest(bs.bsvol,0.1,0.0001,(close,60,iexq,
-          0.01*tbills['4 WEEKS BANK DISCOUNT'].get(date,0.07),
-          ((datetime.datetime(2020,12,11) - datetime.datetime.strptime(date,'%Y-%m-%d')).days/365),
-          30+dtp['Price'][date+' 18:00:00+00:00']))]
-  # it's 30 + option price, because the dataset I got doesn't work with Black-Scholes :(
-  # basically, the option prices are too low, so Black-Scholes can't get there no matter what volatility is used
+  r = 0.01*tbills['4 WEEKS BANK DISCOUNT'].get(date,0.07)
+  t = (datetime.datetime(2020,12,11) - datetime.datetime.strptime(date,'%Y-%m-%d')).days/365
+  bsout += [impliedvol(open,r,t,dtp['Price'][date+' 12:00:00+00:00']),
+            impliedvol(close,r,t,dtp['Price'][date+' 18:00:00+00:00'])]
+  # the option prices in this dataset are often below what Black-Scholes can reach,
+  # those quotes are rejected up front instead of being shifted by +30
 
 # Drawing graphs
 
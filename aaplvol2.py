@@ -1,6 +1,6 @@
 # Version 2 of implied volatility calculator, for the CBOE dataset
 
-import math, numpy as np, pandas as pd, blackscholes as bs, datetime as dt, matplotlib, os, time, pandas_market_calendars as mcal
+import math, numpy as np, pandas as pd, blackscholes as bs, datetime as dt, matplotlib, os, time, tradingdays as td, store, ivcache, warmstart, surface, prefilter, report, plots, chain, marketdata as md
 from mpl_toolkits.mplot3d import axes3d
 import matplotlib.pyplot as plt
 from mpl_toolkits import mplot3d
@@ -15,88 +15,88 @@ from tqdm import tqdm
         (4-week T-Bills in Federal Reserve CSV, sorted by day from 2015 to 2020)
 '''
 
-# Setting up a calendar
+# Setting up a calendar and the run report
 
-nyse = mcal.get_calendar('NYSE')
+run = report.Run('aaplvol2')
+run.mark('calendar')
+nyse = td.load()
 
 # CBOE Option/Underlying Data
 
-'''DataFrame structured as:
-     Columns: 0 = option price, 1 = underlying price, 2 = placeholder,
-              3 = time to expiration in days
-     Row Index: (quote date YYYY-MM-DD, expiration YYYY-MM-DD, strike, Call/Put)
+'''chain.Chain: typed arrays of the contracts (strike, price, spot, days, ...),
+   with room for the dividend, rate and results
 '''
 
-aapl = dict()
-
 # currently set up to find ATM options only
 
-if input('Pull new options data from CBOE CSV? (y/n)\n') == 'y':
-  cpflag = input('Do you want to look at calls or puts? (c/p)\n').capitalize()
+'''Implied vol engine, see bs.SOLVERS:
+     newton = bracketed Newton-Raphson (bsvolbatch), starts from the warm-start guess
+     rational = rational first guess plus two Householder steps (bsvolrational)
+'''
+engine = 'newton'
+
+run.mark()
+cpflag = input('Do you want to look at calls or puts? (c/p)\n').capitalize()
+pull = input('Pull new options data from CBOE CSV? (y/n)\n') == 'y'
+run.mark('ingest')
+if pull:
   print('Getting option/underlying price data...')
-  for dirName, subdirList,fileList in tqdm(os.walk('eod-options')):
-    if fileList != []:
-      df = pd.read_csv(dirName + '/' + fileList[0]).set_index(['quote_date','expiration','strike','option_type'])
-      for index in df.index:
-        if index[3] == cpflag and abs(index[2] - (df['underlying_bid_eod'][index] + df['underlying_ask_eod'][index])/2) < 1:
-          aapl[index] = [(df['bid_eod'][index] + df['ask_eod'][index])/2, 
-                         (df['underlying_bid_eod'][index] + df['underlying_ask_eod'][index])/2,
-                         0,
-                         len(nyse.valid_days(start_date=index[0],end_date=index[1]).date)]
-  aapl = pd.DataFrame(aapl).transpose()
-  aapl.to_csv('aapl.csv')
-  print(aapl)
-else:
-  aapl = pd.read_csv('aapl.csv').set_index(['Unnamed: 0','Unnamed: 1','Unnamed: 2','Unnamed: 3'])
-  cpflag = aapl.index[0][2]
+  store.update('aapl-store','eod-options',nyse,tqdm)
+aapl = chain.Chain.fromtable(store.load('aapl-store',cpflag=cpflag,moneyness=1))
+print(aapl)
 
 # AAPL Dividend Data
 
-'''DataFrame structured as:
-     Columns: Amount = dividend amount
-     Row Index: [Month, Day, Year]
+'''Sorted arrays of pay dates and amounts, see marketdata.py
 '''
 
+run.mark('market data')
 print('Getting dividend data...')
-aapldiv = pd.read_csv('aapl-dividends.csv')
-aapldiv['Pay Date'] = aapldiv['Pay Date'].apply(lambda a: tuple(a.split('-')[::2]))
-aapldiv = aapldiv.set_index('Pay Date')
+aapldiv = md.dividends('aapl-dividends.csv')
 
 # Risk-Free Rate Data
 
-'''DataFrame structured as:
-     Columns: Rate = interest rate for 4-week T-Bill
-     Row Index: Date in YYYY-MM-DD
+'''Sorted arrays of dates and forward-filled rates (as decimals), see marketdata.py
 '''
 
 print('Getting risk-free rate data...')
-rfr = pd.read_csv('FRB_H15.csv').set_index('Date').fillna(method='pad')
+rfr = md.rates('FRB_H15.csv')
 
 # Implied Volatility Calculations
 
+run.mark('solve')
 print('Computing implied volatility...')
-bsvol = np.array([]) # implied volatility
-bsm = np.array([]) # spot/strike
-bsu = np.array([]) # underlying price
-bsk = np.array([]) # strike
-bst = np.array([]) # time to expiration
 starttime = time.time()
 
-badapples = 0
-
-for i, row in tqdm(aapl.iterrows()):
-  try:
-    bsvol = np.append(arr=bsvol,values=bs.nrtest(bs.bsvol,1,0.001,(row[1],i[2],
-                      (1+(aapldiv['Amount'][str(3*(int(i[0].split('-')[1])//4)+2),i[0].split('-')[0]]/row[1]))**4 - 1,
-                      float(rfr['Rate'][i[0]])*0.01,
-                      row[3]/252,row[0],i[3] == 'C')))
-    bsm = np.append(arr=bsm,values=math.log(row[1]/i[2]))
-    bsu = np.append(arr=bsu,values=row[1])
-    bsk = np.append(arr=bsk,values=i[2])
-    bst = np.append(arr=bst,values=row[3])
-  except:
-    badapples += 1
-  # aapldiv['Amount'][str(3*(int(i[0].split('-')[1])//4)+2),i[0].split('-')[0]]
+aapl.join(aapldiv,rfr) # dividend, yield, risk-free rate
+
+# quotes no vol can reach are dropped before solving
+reason = prefilter.check(*aapl.args('bs'),bid=aapl.bid,ask=aapl.ask,model='bs')
+run.check('bs',reason)
+print('Rejected before solving:',prefilter.counts(reason[reason != prefilter.OK]))
+aapl = aapl[reason == prefilter.OK]
+
+bsexp = aapl.dates('expiration') # expiration
+hist = warmstart.load('warmstart-bs.npz')
+x0, found = warmstart.guess(hist,bsexp,aapl.strike,aapl.call,default=1)
+
+cache = ivcache.IVCache()
+solver = (lambda *x: bs.bsvolbatch(*x,e=0.001)) if engine == 'newton' else (lambda *x: bs.SOLVERS[engine](*x[:7]))
+aapl.vol[:], aapl.status[:], aapl.iterations[:] = cache.solve(solver,'bs-' + engine,0,0.001,*aapl.args('bs'),extra=(x0,))
+cache.close()
+
+good = aapl.status == bs.CONVERGED
+run.solver('bs-' + engine,aapl.iterations,aapl.status,bs.bsvec(aapl.vol,*aapl.args('bs')[1:]) - aapl.price,
+           cached=cache.hit)
+warmstart.save(warmstart.update(hist,bsexp,aapl.strike,aapl.call,aapl.vol,good),'warmstart-bs.npz')
+surface.save(surface.update(surface.load('ivsurface-bs.npz'),aapl.dates(),aapl.days/252,aapl.logm,np.where(good,aapl.vol,np.nan)),
+             'ivsurface-bs.npz')
+badapples = len(aapl) - good.sum()
+
+solved = aapl[good]
+bsvol = solved.vol # implied volatility
+bsm = solved.logm # ln(spot/strike)
+bst = solved.days # time to expiration
 
 computetime = time.time() - starttime
 print('Time taken to compute implied volatility:',computetime,'s')
@@ -104,13 +104,12 @@ print(badapples)
 
 # Graphing
 
+run.mark('plot')
 print('Graphing...')
 
 
-pd.DataFrame({'Implied Vol':bsvol,'ln(spot/strike)':bsm,'Underlying Price':bsu}).plot.scatter(x='ln(spot/strike)',y='Implied Vol',c='Underlying Price',colormap='viridis')
-matplotlib.pyplot.savefig('aaplvol-atm1.png')
-pd.DataFrame({'Implied Vol':bsvol,'time to expiry':bst,'Underlying Price':bsu}).plot.scatter(x='time to expiry',y='Implied Vol',c='Underlying Price',colormap='viridis')
-matplotlib.pyplot.savefig('aaplvol-atm2.png')
+plots.density(bsm,bsvol,'aaplvol-atm1.png','ln(spot/strike)','Implied Vol')
+plots.density(bst,bsvol,'aaplvol-atm2.png','time to expiry','Implied Vol')
 
 '''
 x = np.array([])
@@ -140,4 +139,6 @@ plt.savefig('aaplvol3d.png')
 
 # End of Program
 
+run.save('aaplvol2-report.json')
+
 print('Done!')
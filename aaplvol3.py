@@ -4,7 +4,7 @@
    unlike Version 2, which used Black-Scholes
 '''
 
-import math, numpy as np, pandas as pd, american as am, datetime as dt, matplotlib, os, time, pandas_market_calendars as mcal
+import math, numpy as np, pandas as pd, american as am, blackscholes as bs, datetime as dt, matplotlib, os, time, tradingdays as td, store, ivcache, warmstart, surface, prefilter, report, plots, chain, marketdata as md
 from mpl_toolkits.mplot3d import axes3d
 import matplotlib.pyplot as plt
 from mpl_toolkits import mplot3d
@@ -19,42 +19,35 @@ from tqdm import tqdm
         (4-week T-Bills in Federal Reserve CSV, sorted by day from 2015 to 2020)
 '''
 
-# Setting up a calendar
+# Setting up a calendar and the run report
 
-nyse = mcal.get_calendar('NYSE')
+run = report.Run('aaplvol3')
+run.mark('calendar')
+nyse = td.load()
 
 # AAPL Dividend Data
 
-'''DataFrame structured as:
-     Columns: Amount = dividend amount
-     Row Index: [Month, Day, Year]
+'''Sorted arrays of pay dates and amounts, see marketdata.py
 '''
 
+run.mark('market data')
 print('Getting dividend data...')
-aapldiv = pd.read_csv('aapl-dividends.csv')
-aapldiv['Pay Date'] = aapldiv['Pay Date'].apply(lambda a: tuple(a.split('-')[::2]))
-aapldiv = aapldiv.set_index('Pay Date')
+aapldiv = md.dividends('aapl-dividends.csv')
 
 # Risk-Free Rate Data
 
-'''DataFrame structured as:
-     Columns: Rate = interest rate for 4-week T-Bill
-     Row Index: Date in YYYY-MM-DD
+'''Sorted arrays of dates and forward-filled rates (as decimals), see marketdata.py
 '''
 
 print('Getting risk-free rate data...')
-rfr = pd.read_csv('FRB_H15.csv').set_index('Date').fillna(method='pad').applymap(lambda x: x*0.01)
+rfr = md.rates('FRB_H15.csv')
 
 # CBOE Option/Underlying Data
 
-'''DataFrame structured as:
-     Columns: 0 = option price, 1 = underlying price, 2 = strike, 3 = dividend, 
-              4 = risk-free rate, 5 = time to expiration in days
-     Row Index: (quote date YYYY-MM-DD, expiration YYYY-MM-DD, strike, Call/Put)
+'''chain.Chain: typed arrays of the contracts (strike, price, spot, days, ...),
+   with the dividend and rate joined on and room for the results
 '''
 
-aapl = dict()
-
 '''Change moneyness to change the range of options we will look at, with 0 being atm
       0 = at the money
       10 = +/- $10
@@ -63,69 +56,82 @@ aapl = dict()
 '''
 moneyness = 10000
 
-if input('Pull new options data from CBOE CSV? (y/n)\n') == 'y':
-  cpflag = input('Do you want to look at calls or puts? (c/p)\n').capitalize()
+'''Number of steps in the Cox-Ross-Rubenstein tree
+'''
+steps = 100
+
+'''Binomial tree, see american.LATTICES:
+     crr = plain Cox-Ross-Rubenstein
+     lr = Leisen-Reimer, bbs/bbsr = Black-Scholes smoothed last step (with Richardson extrapolation)
+   lr, bbs and bbsr reach the same accuracy with far fewer steps
+'''
+lattice = 'crr'
+
+'''Number of worker processes for the implied vol computation, 1 to run in this process
+'''
+workers = os.cpu_count()
+
+run.mark()
+cpflag = input('Do you want to look at calls or puts? (c/p)\n').capitalize()
+pull = input('Pull new options data from CBOE CSV? (y/n)\n') == 'y'
+run.mark('ingest')
+if pull:
   print('Getting option/underlying price data...')
-  for dirName, subdirList,fileList in tqdm(os.walk('eod-options')):
-    if fileList != []:
-      df = pd.read_csv(dirName + '/' + fileList[0]).set_index(['quote_date','expiration','strike','option_type'])
-      for index in df.index:
-        if index[3] == cpflag and abs(index[2] - (df['underlying_bid_eod'][index] + df['underlying_ask_eod'][index])/2) < moneyness:
-          aapl[index] = [(df['bid_eod'][index] + df['ask_eod'][index])/2, 
-                         (df['underlying_bid_eod'][index] + df['underlying_ask_eod'][index])/2,
-                         index[2],
-                         aapldiv['Amount'][ str( 3*(int( index[0].split('-')[1] )//4)+2 ),index[0].split('-')[0] ],
-                         rfr['Rate'][index[0]],
-                         len(nyse.valid_days(start_date=index[0],end_date=index[1]).date),
-                         np.log(((df['underlying_bid_eod'][index] + df['underlying_ask_eod'][index])/2)/index[2])]
-  aapl = pd.DataFrame(aapl).transpose()
-  aapl.to_csv('aapl.csv')
-  print(aapl)
-else:
-  aapl = pd.read_csv('aapl.csv').set_index(['Unnamed: 0','Unnamed: 1','Unnamed: 2','Unnamed: 3'])
-  cpflag = aapl.index[0][2]
+  store.update('aapl-store','eod-options',nyse,tqdm)
+aapl = chain.Chain.fromtable(store.load('aapl-store',cpflag=cpflag,moneyness=moneyness)).join(aapldiv,rfr)
+# quotes no vol can reach are dropped before solving
+reason = prefilter.check(*aapl.args('crr'),bid=aapl.bid,ask=aapl.ask,model='crr')
+run.check('crr',reason)
+print('Rejected before solving:',prefilter.counts(reason[reason != prefilter.OK]))
+aapl = aapl[reason == prefilter.OK]
+print(aapl)
 
 # Implied Volatility Calculations
 
+run.mark('solve')
 print('Computing implied volatility...')
 starttime = time.time()
 
-crrmap = lambda x: am.oliveira_takahashi(am.crr,tuple(x)[0],0,3,e=0.0001,args=(10,) + tuple(x)[1:-1])
-
-testy = lambda y: print(y)
-
-crr_iv = pd.DataFrame(aapl.apply(crrmap,result_type='reduce',raw=False,axis=1).tolist())
-
-print("crr iv\n",crr_iv[0].describe(),"\nsteps\n",crr_iv[1].describe())
+crrexp = aapl.dates('expiration')
+hist = warmstart.load('warmstart-crr.npz')
+x0, found = warmstart.guess(hist,crrexp,aapl.strike,aapl.call)
+
+cache = ivcache.IVCache()
+aapl.vol[:], aapl.iterations[:] = cache.solve(lambda *x: warmstart.crrvol(*x,steps=steps,a0=0,b0=3,e=0.0001,workers=workers,
+                                                                          lattice=lattice),
+                                              'crr' if lattice == 'crr' else 'crr-' + lattice,steps,0.0001,
+                                              *aapl.args('crr'),extra=(x0,found))
+residual = am.crrbatch(aapl.vol,steps,*aapl.args('crr')[1:],lattice) - aapl.price
+aapl.status[:] = report.itpstatus(aapl.vol,aapl.iterations,residual=residual)
+cache.close()
+solved = aapl.status == bs.CONVERGED
+warmstart.save(warmstart.update(hist,crrexp,aapl.strike,aapl.call,aapl.vol,solved),'warmstart-crr.npz')
+surfpath = 'ivsurface-crr.npz' if lattice == 'crr' else 'ivsurface-crr-%s.npz' % lattice
+surface.save(surface.update(surface.load(surfpath),aapl.dates(),aapl.days/252,aapl.logm,np.where(solved,aapl.vol,np.nan)),surfpath)
+run.solver('crr',aapl.iterations,aapl.status,residual,cached=cache.hit)
+
+print("crr iv\n",pd.Series(aapl.vol).describe(),"\nsteps\n",pd.Series(aapl.iterations).describe())
 
 computetime = time.time() - starttime
 print('Time taken to compute implied volatility:',computetime)
 
 # Graphing
 
+run.mark('plot')
 print('Graphing...')
 
-av = 0.05
-
-aapl = aapl.reset_index()
-
-
-pd.DataFrame({'Implied Vol':crr_iv[0],'ln(spot/strike)':aapl[6],'Underlying Price':aapl[1]}).plot.scatter(x='ln(spot/strike)',y='Implied Vol',c='Underlying Price',alpha=av,colormap='viridis')
-matplotlib.pyplot.savefig('aaplvol-crr-mega-2d1.png')
-pd.DataFrame({'Implied Vol':crr_iv[0],'time to expiry':aapl[5],'Underlying Price':aapl[1]}).plot.scatter(x='time to expiry',y='Implied Vol',c='Underlying Price',alpha=av,colormap='viridis')
-matplotlib.pyplot.savefig('aaplvol-crr-mega-2d2.png')
-
-fig = plt.figure()
-ax = plt.axes(projection='3d')
-ax.plot_trisurf(aapl[5], aapl[6], crr_iv[0], cmap='viridis', edgecolor='none', linewidth = 0, antialiased=True)
-ax.set_xlabel('Time to Expiration')
-ax.set_ylabel('ln(Spot/Strike)')
-ax.set_zlabel('Implied Volatility')
-plt.title('AAPL ATM Calls 2018-09-04 to 2018-11-30')
-plt.savefig('aaplvol-crr-mega-3d.png')
+iv = np.where(solved,aapl.vol,np.nan)
+plots.density(aapl.logm,iv,'aaplvol-crr-mega-2d1.png','ln(spot/strike)','Implied Vol')
+plots.density(aapl.days,iv,'aaplvol-crr-mega-2d2.png','time to expiry','Implied Vol')
+plots.heatmap(aapl.days,aapl.logm,iv,'aaplvol-crr-mega-heat.png',
+              'Time to Expiration','ln(Spot/Strike)','Implied Volatility')
+plots.surface3d(aapl.days,aapl.logm,iv,'aaplvol-crr-mega-3d.png',
+                'Time to Expiration','ln(Spot/Strike)','Implied Volatility',title='AAPL ATM Calls 2018-09-04 to 2018-11-30')
 
 
 
 # End of Program
 
+run.save('aaplvol3-report.json')
+
 print('Done!')
@@ -1,4 +1,4 @@
-import numpy as np, time
+import numpy as np, time, blackscholes as bs
 
 '''Implementation of the Cox-Ross-Rubinsten model
    for binomial pricing of options, optimized with Brent's method
@@ -15,7 +15,7 @@ tr = 0.05 # risk-free
 tp = 1.9174 # price
 # implied vol should be 0.4
 
-def crr(v,n,s,k,q,r,t):
+def crr(v,n,s,k,q,r,t,call=True):
   '''Cox-Ross-Rubenstein Model
        v = volatility
        n = max number of steps
@@ -32,7 +32,184 @@ def crr(v,n,s,k,q,r,t):
   p = (rhat-d)/max(u-d,0.0000001)
   # print(u,d,rhat,p)
 
-  return crrprice(crrtree(u,d,n,s),k,q,rhat,t,n,p)
+  return crrinduct(u,d,n,s,k,q,rhat,t,p,call)
+
+'''Lattices crrbatch() can price with, by name:
+     crr = Cox-Ross-Rubenstein, u = exp(v*sqrt(dt)), d = 1/u
+     lr = Leisen-Reimer, u, d and p from the Peizer-Pratt inversion of d1 and d2,
+          so the tree is centred on the strike (needs an odd number of steps,
+          n is raised by one if it is odd, since the tree has n-1 steps)
+     bbs = Cox-Ross-Rubenstein with the step before expiry valued by
+           Black-Scholes instead of the payoff, which smooths the kink at the strike
+     bbsr = bbs with two-point Richardson extrapolation over trees of 2m and m
+            steps, 2*bbs(2m+1) - bbs(m+1) (n is raised by one if it is even,
+            so the tree has an even number of steps to halve, and to 3 at least)
+   crr keeps the original time grid of crr(): n levels dt = t/n apart, so the
+   tree stops one step short of expiry. The others stretch dt to t/(n-1) so
+   the n-1 steps end at expiry. crr oscillates in n and converges slowly, and
+   the others converge much faster to the n -> infinity price, so the same
+   pricing error needs far fewer steps (see bench.py --convergence).
+'''
+
+LATTICES = ['crr','lr','bbs','bbsr']
+
+def crrparams(v,n,r,t):
+  '''(u, d, rhat, p) of the Cox-Ross-Rubenstein tree, see crr()
+  '''
+  u = np.exp(v*((t/252)/n)**0.5)
+  d = 1/np.maximum(u,0.0000001)
+  rhat = (r+1)**((t/252)/n)
+  p = (rhat-d)/np.maximum(u-d,0.0000001)
+  return u, d, rhat, p
+
+def minvol(n,r,t,model='crr'):
+  '''smallest vol at which the tree crrbatch() builds for model has p <= 1,
+     log(rhat)/sqrt(dt): below it u < rhat, the tree is not arbitrage-free
+     and its prices blow up, so root finders should not search there
+       n, r, t = same as crrbatch()
+       model = lattice, see LATTICES (lr clips p itself and returns 0)
+  '''
+  n = np.asarray(n,dtype=float)
+  t = np.asarray(t,dtype=float)
+  if model == 'lr':
+    return np.zeros(np.broadcast(n,r,t).shape)
+  if model == 'bbsr':
+    # the coarser of its two trees has (n-1)//2 steps, see crrbatch()
+    n = np.maximum(n,3)
+    steps = (n + 1 - n % 2 - 1)//2
+  elif model == 'bbs':
+    steps = n - 1
+  else:
+    steps = n
+  return np.log(np.asarray(r,dtype=float) + 1)*np.sqrt((t/252)/steps)
+
+def peizerpratt(z,m):
+  '''Peizer-Pratt method 2 inversion of the normal cdf for an m-step tree
+  '''
+  return 0.5 + np.sign(z)*np.sqrt(0.25 - 0.25*np.exp(-(z/(m + 1/3 + 0.1/(m+1)))**2*(m + 1/6)))
+
+def lrparams(v,n,s,k,r,t):
+  '''(u, d, rhat, p) of the Leisen-Reimer tree over the n-1 steps of
+     length dt = t/n after them, see LATTICES
+  '''
+  dt = (t/252)/n
+  m = n-1
+  vst = v*(m*dt)**0.5
+  rhat = (r+1)**dt
+  with np.errstate(divide='ignore',invalid='ignore'):
+    # a zero vol (the bottom of the ITP bracket) gives infinite d1 and d2
+    d1 = np.nan_to_num((np.log(s/k) + (np.log(r+1) + 0.5*v*v)*m*dt)/vst,posinf=1e6,neginf=-1e6)
+  d2 = d1 - vst
+  # with p and p' both at a limit the tree collapses to u = d = rhat
+  p = np.clip(peizerpratt(d2,m),0.0000001,1-0.0000001)
+  u = rhat*np.clip(peizerpratt(d1,m),0.0000001,1-0.0000001)/p
+  d = (rhat - p*u)/(1-p)
+  return u, d, rhat, p
+
+def crrbatch(v,n,s,k,q,r,t,call=True,model='crr'):
+  '''Cox-Ross-Rubenstein Model for a whole chain of contracts at once
+       v, n, s, k, q, r, t, call = same as crr(), as arrays or broadcastable scalars
+       model = lattice to price with, see LATTICES
+     Contracts are grouped by step count, and each group is priced as one
+     (contract x node) array, so every level of the tree costs a handful
+     of array operations for the whole group. Matches crr() up to rounding
+     with model = 'crr'.
+  '''
+  if model == 'bbsr':
+    # n levels are n-1 steps, so 2m steps are n = 2m+1 and m steps are m+1
+    n = np.maximum(np.asarray(n,dtype=int),3)
+    n = n + 1 - n % 2
+    return 2*crrbatch(v,n,s,k,q,r,t,call,'bbs') - crrbatch(v,(n-1)//2 + 1,s,k,q,r,t,call,'bbs')
+  if model not in LATTICES:
+    raise ValueError('unknown lattice %r, expected one of %s' % (model,', '.join(LATTICES)))
+
+  v, s, k, q, r, t = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (v,s,k,q,r,t)))
+  shape = v.shape
+  n = np.broadcast_to(np.asarray(n,dtype=int),shape).ravel()
+  call = np.broadcast_to(np.asarray(call,dtype=bool),shape).ravel()
+  v, s, k, q, r, t = (a.ravel() for a in (v,s,k,q,r,t))
+  if model == 'lr':
+    n = n + n % 2
+
+  out = np.empty(v.shape)
+  for steps in np.unique(n):
+    g = np.flatnonzero(n == steps)
+    gv, gs, gk, gq, gr, gt = (a[g,None] for a in (v,s,k,q,r,t))
+    gcall = call[g,None]
+    # n-1 steps of t/(n-1), see LATTICES
+    gt = gt*steps/(steps-1) if model != 'crr' else gt
+    if model == 'lr':
+      u, d, rhat, p = lrparams(gv,steps,gs,gk,gr,gt)
+    else:
+      u, d, rhat, p = crrparams(gv,steps,gr,gt)
+    european = None
+    if model == 'bbs':
+      dt = (gt/252)/steps
+      european = lambda x: bs.bsvec(gv,x,gk,0,np.log(gr+1),dt,gcall)
+    out[g] = crrlevels(u,d,int(steps),gs,gk,gq,rhat,gt,p,gcall,european=european)[0][...,0]
+  return out.reshape(shape)
+
+def crrgreeks(v,n,s,k,q,r,t,call=True,extended=False,dv=0.01,dr=0.0001):
+  '''Cox-Ross-Rubenstein price and Greeks for a whole chain of contracts
+       v, n, s, k, q, r, t, call = same as crrbatch()
+       extended = False to read delta, gamma and theta off levels 1 and 2
+                  of the pricing tree, True to grow the tree by two steps
+                  before today so that level 2 is centred on the spot
+                  (more accurate theta and gamma, for two more levels)
+       dv, dr = bumps for vega and rho (the tree price moves in small steps
+                as v shifts the nodes past the strike, so dv is not tiny)
+     Delta, gamma and theta come from the nodes the backward induction
+     already visits, so they cost nothing over the price. Vega and rho are
+     not on the tree, so they are central differences of crrbatch(), with
+     the four bumped trees priced in the same batch as one array.
+     Theta is per year of the tree's 252-day years, vega and rho per unit,
+     like blackscholes.bsgreeks().
+     Returns (price, delta, gamma, theta, vega, rho) arrays, all nan for
+     trees of fewer than 3 levels (n < 3 unless extended), which have no level 2.
+  '''
+  v, s, k, q, r, t = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (v,s,k,q,r,t)))
+  shape = v.shape
+  n = np.broadcast_to(np.asarray(n,dtype=int),shape).ravel()
+  call = np.broadcast_to(np.asarray(call,dtype=bool),shape).ravel()
+  v, s, k, q, r, t = (a.ravel() for a in (v,s,k,q,r,t))
+
+  price, delta, gamma, theta = (np.empty(v.shape) for i in range(4))
+  for steps in np.unique(n):
+    g = np.flatnonzero(n == steps)
+    if steps + 2*extended < 3:
+      price[g], delta[g], gamma[g], theta[g] = np.nan, np.nan, np.nan, np.nan
+      continue
+    gv, gs, gk, gq, gr, gt = (a[g,None] for a in (v,s,k,q,r,t))
+    dt = (gt/252)/steps
+    u, d, rhat, p = crrparams(gv,steps,gr,gt)
+    if extended:
+      # same dt, two more steps, starting 2dt before today
+      steps, gt = steps + 2, gt*(steps + 2)/steps
+    v0, v1, v2 = crrlevels(u,d,int(steps),gs,gk,gq,rhat,gt,p,call[g,None],keep=3)
+    s2 = crrlevel(u,d,2,gs)
+    # gamma from the three nodes of level 2, delta from level 1 (or level 2 if extended)
+    gamma[g] = (((v2[:,2]-v2[:,1])/(s2[:,2]-s2[:,1]) - (v2[:,1]-v2[:,0])/(s2[:,1]-s2[:,0]))
+                /(0.5*(s2[:,2]-s2[:,0])))
+    theta[g] = (v2[:,1] - v0[:,0])/(2*dt[:,0])
+    if extended:
+      price[g] = v2[:,1]
+      delta[g] = (v2[:,2]-v2[:,0])/(s2[:,2]-s2[:,0])
+    else:
+      s1 = crrlevel(u,d,1,gs)
+      price[g] = v0[:,0]
+      delta[g] = (v1[:,1]-v1[:,0])/(s1[:,1]-s1[:,0])
+    # a tree with p outside [0,1] (vol too small for the rate) has no meaningful Greeks
+    bad = g[(p[:,0] < 0) | (p[:,0] > 1)]
+    delta[bad], gamma[bad], theta[bad] = np.nan, np.nan, np.nan
+
+  m = len(v)
+  vlo = np.maximum(v-dv,0.5*v) # keep the lower bump above 0 for small vols
+  bumped = crrbatch(np.concatenate((v+dv,vlo,v,v)),np.tile(n,4),np.tile(s,4),np.tile(k,4),np.tile(q,4),
+                    np.concatenate((r,r,r+dr,r-dr)),np.tile(t,4),np.tile(call,4))
+  vega = (bumped[:m] - bumped[m:2*m])/(v+dv-vlo)
+  rho = (bumped[2*m:3*m] - bumped[3*m:])/(2*dr)
+  vega[np.isnan(delta)], rho[np.isnan(delta)] = np.nan, np.nan
+  return tuple(x.reshape(shape) for x in (price,delta,gamma,theta,vega,rho))
 
 def cantor(l,r):
   '''cantor pairing function
@@ -67,18 +244,60 @@ def crrtree(u,d,n,s):
   # print(tree,len(tree))
   return tree
 
-def crrprice(tree,k,q,rhat,t,n,p,i=1,j=0):
-  '''works backward through the tree to find the price at i = 0
+def crrlevel(u,d,l,s):
+  '''prices of the underlying on level l of the tree,
+     the same values crrtree() stores for that level
+     (one row per contract if u, d and s are columns)
   '''
-  div = (1-(q/tree[j]))**((t*((n-i)/n))//62.5)
-  # print(tree[j] - k)
-  if i == n:
-    return max(0,div*tree[j]-k)
-  else:
-    return max(div*tree[j]-k,
-               (p*crrprice(tree,k,q,rhat,t,n,p,i+1,j+i+1) + 
-                (1-p)*crrprice(tree,k,q,rhat,t,n,p,i+1,j+i))
-               /rhat)
+  j = np.arange(l+1)
+  return u**j * d**(l-j) * s
+
+def crrnode(s,k,q,t,n,l,cont,call=True):
+  '''value of the nodes on level l, given the continuation values
+     of those nodes (None on the last level)
+  '''
+  div = (1-(q/s))**((t*((n-l-1)/n))//62.5)
+  exercise = np.where(call,1,-1)*(div*s-k)
+  if cont is None:
+    return np.maximum(0,exercise)
+  return np.maximum(exercise,cont)
+
+def crrinduct(u,d,n,s,k,q,rhat,t,p,call=True):
+  '''works backward through the tree to find the price at the root,
+     generating one level of the underlying at a time and keeping only
+     the option values of the level below it: O(n^2) time, O(n) memory
+     u, d, s, k, q, rhat, t, p and call may be columns, one row per contract
+  '''
+  return crrlevels(u,d,n,s,k,q,rhat,t,p,call)[0][...,0]
+
+def crrlevels(u,d,n,s,k,q,rhat,t,p,call=True,keep=1,european=None):
+  '''crrinduct(), but returns the option values on the first keep levels
+     of the tree, [level 0, level 1, ...], instead of only the root
+       european = function of the underlying prices on the level before
+                  the last, giving the continuation values there (e.g.
+                  Black-Scholes over one step), None to induct from the payoff
+  '''
+  val = crrnode(crrlevel(u,d,n-1,s),k,q,t,n,n-1,None,call)
+  out = [val] if n-1 < keep else []
+  for l in range(n-2,-1,-1):
+    if european is not None and l == n-2:
+      cont = european(crrlevel(u,d,l,s))
+    else:
+      cont = (p*val[...,1:] + (1-p)*val[...,:-1])/rhat
+    val = crrnode(crrlevel(u,d,l,s),k,q,t,n,l,cont,call)
+    if l < keep:
+      out.append(val)
+  return out[::-1]
+
+def crrprice(tree,k,q,rhat,t,n,p,call=True):
+  '''works backward through a tree from crrtree() to find the price at the root,
+     one level at a time
+  '''
+  val = crrnode(tree[(n-1)*n//2:],k,q,t,n,n-1,None,call)
+  for l in range(n-2,-1,-1):
+    cont = (p*val[1:] + (1-p)*val[:-1])/rhat
+    val = crrnode(tree[l*(l+1)//2:(l+1)*(l+2)//2],k,q,t,n,l,cont,call)
+  return val[0]
 
 def oliveira_takahashi(f,n0,a0,b0,e=0.001,args=()):
   '''Implements the Oliveira-Takahashi root-finding method
@@ -142,7 +361,83 @@ def oliveira_takahashi(f,n0,a0,b0,e=0.001,args=()):
     return (out,k)
   else: 
     return (0.,k)
-    
+
+def lanes(args,idx,shape):
+  '''picks the lanes idx out of every array argument,
+     scalar arguments (like the number of steps) are passed through
+  '''
+  return tuple(x if np.ndim(x) == 0 else np.broadcast_to(x,shape).ravel()[idx] for x in args)
+
+def itpbatch(f,y,a0,b0,e=0.001,n0=1,kmax=35,args=()):
+  '''Oliveira-Takahashi (ITP) root finding for whole arrays of target prices:
+       f = the pricing function, must take an array of vols as its first argument
+           and return an array of prices, like crrbatch()
+       y = target prices
+       a0, b0 = starting interval [a,b], scalars or arrays
+       e = error term, 0 < e
+       n0 = slack on the number of iterations over bisection, 0 <= n0
+       kmax = cap on iterations per lane
+       args = other required arguments, arrays are split by lane
+     Each lane carries its own bracket, target and iteration counter. Every
+     iteration calls f once for the lanes that are still active, and lanes
+     retire as soon as their bracket is narrower than 2e. Lanes whose bracket
+     does not contain a root are retired straight away.
+     Returns (vol, k) arrays, with vol = 0 where no root was found, like
+     oliveira_takahashi(). f must be finite and monotone over [a0, b0]: for
+     crrbatch() start a0 at minvol(), below it the prices blow up and their
+     sign changes are not roots.
+  '''
+  y, a0, b0 = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (y,a0,b0)))
+  shape = y.shape
+  y, a0, b0 = y.ravel(), a0.ravel(), b0.ravel()
+  g = lambda x,idx: f(*(x,) + lanes(args,idx,shape)) - y[idx]
+
+  a = a0.copy()
+  b = b0.copy()
+  ya = g(a,slice(None))
+  yb = g(b,slice(None))
+  n_max = np.ceil(np.log2( (b-a)/(2*e) )) + n0
+  k = np.zeros(y.shape,dtype=int)
+  k1 = 0.1
+  k2 = 2.5656733 # roughly 0.98*(1 + golden ratio)
+
+  nan = ~(np.isfinite(ya) & np.isfinite(yb))
+  found = ~nan & (ya <= 0) & (yb >= 0)
+  idx = np.flatnonzero(found & (b - a > 2 * e))
+
+  while idx.size:
+    ai, bi, yai, ybi = a[idx], b[idx], ya[idx], yb[idx]
+
+    # interpolation
+    x_half = (ai+bi)/2
+    with np.errstate(divide='ignore',invalid='ignore'):
+      x_f = np.where(ybi != yai,(ybi * ai - yai * bi)/(ybi - yai),x_half)
+
+    # truncation
+    sigma = np.sign(x_half - x_f)
+    delta = k1 * np.abs(bi-ai)**k2
+    x_t = np.where(delta <= np.abs(x_half - x_f),x_f + sigma*delta,x_half)
+
+    # projection
+    r = e * 2.**(n_max[idx] - k[idx]) - (bi-ai)/2
+    x_guess = np.where(np.abs(x_t - x_half) <= r,x_t,x_half - sigma*r)
+
+    # updating
+    y_guess = g(x_guess,idx)
+    up = y_guess > 0
+    down = y_guess < 0
+    hit = ~up & ~down
+    a[idx] = np.where(down | hit,x_guess,ai)
+    ya[idx] = np.where(down,y_guess,yai)
+    b[idx] = np.where(up | hit,x_guess,bi)
+    yb[idx] = np.where(up,y_guess,ybi)
+    k[idx] += 1
+
+    idx = idx[(b[idx] - a[idx] > 2 * e) & (k[idx] < kmax)]
+
+  out = np.where(found,(a+b)/2,0.)
+  return out.reshape(shape), k.reshape(shape)
+
 
 # test
 
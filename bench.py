@@ -0,0 +1,235 @@
+'''Benchmark suite for the pricers, the implied vol solvers and the ingest pipeline
+
+   Everything runs on a synthetic option chain in the CBOE end-of-day format,
+   so no network or vendor data is needed. Each benchmark reports throughput in
+   contracts per second and peak memory (from tracemalloc), and every run is
+   appended to a JSON-lines file, tagged with the git commit, so a regression
+   shows up against the last run of the same benchmark:
+
+     python bench.py                  full sweep
+     python bench.py --quick          small sizes, for a smoke test
+     python bench.py --convergence    pricing error of each lattice against a high-n reference
+'''
+
+import os, sys, json, time, argparse, tempfile, subprocess, tracemalloc, numpy as np, pandas as pd
+import blackscholes as bs, american as am, tradingdays as td, cboe
+
+RESULTS = 'bench-results.jsonl'
+
+CBOE_COLUMNS = ['underlying_symbol','quote_date','root','expiration','strike','option_type',
+                'open','high','low','close','trade_volume',
+                'bid_size_1545','bid_1545','ask_size_1545','ask_1545','underlying_bid_1545','underlying_ask_1545',
+                'bid_size_eod','bid_eod','ask_size_eod','ask_eod','underlying_bid_eod','underlying_ask_eod']
+
+# Synthetic data
+
+def chain(date,spot=200.,expirations=12,strikes=60,seed=0):
+  '''one quote date of a synthetic AAPL chain in the CBOE layout,
+     priced with Black-Scholes off a smile, with a spread around each mid
+  '''
+  rng = np.random.default_rng(seed)
+  date = np.datetime64(date,'D')
+  exp = date + np.sort(rng.choice(np.arange(3,720),expirations,replace=False))
+  k = np.round(spot*np.linspace(0.6,1.4,strikes))
+  exp, k, cp = (x.ravel() for x in np.meshgrid(exp,k,np.array(['C','P']),indexing='ij'))
+  t = (exp - date).astype(float)/365
+  vol = 0.25 + 0.3*np.log(k/spot)**2 + 0.02/np.sqrt(t)
+  mid = bs.bsvec(vol,spot,k,0.01,0.02,t,cp == 'C')
+  half = np.maximum(0.01,0.02*mid)
+  n = len(k)
+  df = pd.DataFrame({c:np.zeros(n) for c in CBOE_COLUMNS})
+  df['underlying_symbol'] = '^AAPL'
+  df['root'] = 'AAPL'
+  df['quote_date'] = str(date)
+  df['expiration'] = exp.astype(str)
+  df['strike'] = k
+  df['option_type'] = cp
+  df['bid_eod'] = np.maximum(0,np.round(mid - half,2))
+  df['ask_eod'] = np.round(mid + half,2)
+  df['underlying_bid_eod'] = spot - 0.05
+  df['underlying_ask_eod'] = spot + 0.05
+  return df
+
+def tree(root,start='2018-09-04',days=5,**kwargs):
+  '''writes days of synthetic chains as an eod-options tree under root
+  '''
+  dates = np.busday_offset(np.datetime64(start,'D'),np.arange(days),roll='forward')
+  for i, date in enumerate(dates):
+    d = str(date)
+    folder = os.path.join(root,d[:4],d[5:7])
+    os.makedirs(folder,exist_ok=True)
+    chain(d,seed=i,**kwargs).to_csv(os.path.join(folder,'UnderlyingOptionsEODQuotes_%s.csv' % d),index=False)
+
+def contracts(n,seed=0):
+  '''n random contracts with their Black-Scholes prices: (p,s,k,q,r,t,call,v)
+  '''
+  rng = np.random.default_rng(seed)
+  s = np.full(n,200.)
+  k = rng.uniform(150,250,n)
+  t = rng.uniform(0.05,2,n)
+  v = rng.uniform(0.15,0.8,n)
+  call = rng.random(n) < 0.5
+  p = bs.bsvec(v,s,k,0.01,0.02,t,call)
+  return p, s, k, np.full(n,0.01), np.full(n,0.02), t, call, v
+
+# Measurement
+
+def measure(name,n,fn,repeat=3,**info):
+  '''best wall time of repeat runs of fn, plus peak memory of one more run under tracemalloc
+  '''
+  best = float('inf')
+  for i in range(repeat):
+    start = time.perf_counter()
+    fn()
+    best = min(best,time.perf_counter() - start)
+  tracemalloc.start()
+  fn()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  out = {'bench':name,'contracts':n,'seconds':best,'contracts_per_s':n/best if best > 0 else float('inf'),
+         'peak_mb':peak/2**20}
+  out.update(info)
+  return out
+
+def suite(quick=False):
+  '''runs every benchmark, returns a list of result dicts
+  '''
+  small = 200 if quick else 2000
+  large = 2000 if quick else 200000
+  steps = [25,50] if quick else [25,50,100,200,400]
+  results = []
+
+  p, s, k, q, r, t, call, v = contracts(large)
+  results.append(measure('bsvec',large,lambda: bs.bsvec(v,s,k,q,r,t,call)))
+  results.append(measure('bsvegavec',large,lambda: bs.bsvegavec(v,s,k,q,r,t)))
+  results.append(measure('bsgreeks',large,lambda: bs.bsgreeks(v,s,k,q,r,t,call)))
+  results.append(measure('bsvolbatch',large,lambda: bs.bsvolbatch(p,s,k,q,r,t,call)))
+  results.append(measure('bsvolrational',large,lambda: bs.bsvolrational(p,s,k,q,r,t,call)))
+
+  p, s, k, q, r, t, call, v = contracts(small)
+  results.append(measure('bs',small,lambda: [bs.bs(v[i],s[i],k[i],q[i],r[i],t[i],call[i]) for i in range(small)]))
+  results.append(measure('bsvega',small,lambda: [bs.bsvega(v[i],s[i],k[i],q[i],r[i],t[i]) for i in range(small)]))
+  def nrloop():
+    for i in range(small):
+      try:
+        bs.nrtest(bs.bsvol,0.5,0.0001,(s[i],k[i],q[i],r[i],t[i],p[i],call[i]))
+      except Exception:
+        pass
+  results.append(measure('nrtest',small,nrloop))
+
+  # American: prices in dollars of dividend and days to expiry, as aaplvol3.py uses them
+  few = max(small//10,20)
+  days = np.round(t[:few]*252)
+  qd = np.full(few,0.73)
+  for n in steps:
+    results.append(measure('crr',few,lambda: [am.crr(v[i],n,s[i],k[i],qd[i],r[i],days[i]) for i in range(few)],
+                           repeat=1,steps=n))
+    results.append(measure('crrbatch',small,lambda: am.crrbatch(v,n,s,k,0.73,r,np.round(t*252),call),steps=n))
+    results.append(measure('crrgreeks',small,lambda: am.crrgreeks(v,n,s,k,0.73,r,np.round(t*252),call),steps=n))
+
+  n = steps[0]
+  pa = am.crrbatch(v[:few],n,s[:few],k[:few],0.73,r[:few],days,True)
+  results.append(measure('oliveira_takahashi',few,
+                         lambda: [am.oliveira_takahashi(am.crr,pa[i],0,3,e=0.0001,args=(n,s[i],k[i],0.73,r[i],days[i]))
+                                  for i in range(few)],repeat=1,steps=n))
+  results.append(measure('itpbatch',few,lambda: am.itpbatch(am.crrbatch,pa,0,3,e=0.0001,
+                                                            args=(n,s[:few],k[:few],0.73,r[:few],days,True)),steps=n))
+
+  # end to end: read a synthetic eod-options tree, then solve every contract
+  with tempfile.TemporaryDirectory() as root:
+    ndays = 2 if quick else 20
+    tree(root,days=ndays,expirations=6 if quick else 12,strikes=20 if quick else 60)
+    cal = td.load(os.path.join(root,'nyse-days.npz'),'2018-01-01','2020-12-31')
+    table = cboe.ingest(root,days=cal)
+    def pipeline():
+      c = cboe.ingest(root,days=cal)
+      bs.bsvolbatch(c['price'].to_numpy(),c['spot'].to_numpy(),c['strike'].to_numpy(),0.01,0.02,
+                    c['days'].to_numpy()/252,c['call'].to_numpy())
+    results.append(measure('ingest',len(table),lambda: cboe.ingest(root,days=cal),days=ndays))
+    results.append(measure('ingest+bsvolbatch',len(table),pipeline,days=ndays))
+  return results
+
+# Lattice convergence
+
+def convergence(steps=(25,50,100,200,400),reference=2000,n=40,seed=0):
+  '''max and mean absolute price error of every lattice in american.LATTICES
+     at each step count, against the Leisen-Reimer price with reference steps,
+     for random American calls and puts with a dividend
+     Returns a list of dicts, one per (lattice, steps).
+  '''
+  p, s, k, q, r, t, call, v = contracts(n,seed)
+  days = np.round(t*252)
+  ref = am.crrbatch(v,reference,s,k,0.73,r,days,call,'lr')
+  out = []
+  for lattice in am.LATTICES:
+    for m in steps:
+      start = time.perf_counter()
+      err = np.abs(am.crrbatch(v,m,s,k,0.73,r,days,call,lattice) - ref)
+      out.append({'lattice':lattice,'steps':m,'max_error':float(err.max()),'mean_error':float(err.mean()),
+                  'seconds':time.perf_counter() - start})
+  return out
+
+def table(rows):
+  print('%-8s %6s %12s %12s %10s' % ('lattice','steps','max error','mean error','seconds'))
+  for x in rows:
+    print('%-8s %6d %12.2e %12.2e %10.4f' % (x['lattice'],x['steps'],x['max_error'],x['mean_error'],x['seconds']))
+
+# Storage and comparison
+
+def version():
+  '''git commit of the tree being measured, with a + if it has local changes
+  '''
+  here = os.path.dirname(os.path.abspath(__file__))
+  try:
+    commit = subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,cwd=here).stdout.strip()
+    dirty = subprocess.run(['git','status','--porcelain','--untracked-files=no'],capture_output=True,text=True,cwd=here).stdout.strip()
+  except OSError:
+    return 'unknown'
+  return commit + ('+' if dirty else '') if commit else 'unknown'
+
+def key(x):
+  '''what a result is compared on: the benchmark, its step count and its
+     number of contracts, so a --quick run is never held against a full one
+  '''
+  return x['bench'], x.get('steps'), x['contracts']
+
+def previous(path=RESULTS):
+  '''last stored result of every key()
+  '''
+  last = dict()
+  if os.path.exists(path):
+    with open(path) as f:
+      for line in f:
+        x = json.loads(line)
+        last[key(x)] = x
+  return last
+
+def save(results,path=RESULTS):
+  with open(path,'a') as f:
+    for x in results:
+      f.write(json.dumps(x) + '\n')
+
+def report(results,last):
+  for x in results:
+    old = last.get(key(x))
+    change = '' if old is None else '  (%+.0f%% vs %s)' % (100*(x['contracts_per_s']/old['contracts_per_s'] - 1),old['version'])
+    name = x['bench'] + ('' if x.get('steps') is None else '[n=%d]' % x['steps'])
+    print('%-24s %12.0f contracts/s %9.1f MB%s' % (name,x['contracts_per_s'],x['peak_mb'],change))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--quick',action='store_true',help='small sizes, for a smoke test')
+  parser.add_argument('--out',default=RESULTS,help='JSON-lines file the results are appended to')
+  parser.add_argument('--convergence',action='store_true',help='print the lattice convergence table and exit')
+  args = parser.parse_args()
+
+  if args.convergence:
+    table(convergence())
+    sys.exit(0)
+
+  stamp = {'version':version(),'time':time.strftime('%Y-%m-%dT%H:%M:%S'),'quick':args.quick,
+           'python':sys.version.split()[0],'numpy':np.__version__}
+  last = previous(args.out)
+  results = [dict(x,**stamp) for x in suite(args.quick)]
+  report(results,last)
+  save(results,args.out)
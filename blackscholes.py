@@ -7,7 +7,8 @@
 
 # Work in progress!
 
-import math
+import math, numpy as np
+from scipy.special import ndtr, ndtri, erfcx
 
 # test values
 
@@ -57,19 +58,98 @@ def bsvega(v,s,k,q,r,t):
   d1 = (math.log(s/k) + (r + (0.5)*v*v)*t)/(v*(t**0.5))
   d2 = d1 - v*(t**0.5)
 
-  return s*math.exp(-q*t)*cdf(d1)*(t**0.5)
+  return s*math.exp(-q*t)*math.exp(-0.5*d1*d1)/(2.0*math.pi)**0.5*(t**0.5)
 
 # print('Vega:',bsvega(0.4,ts,tk,tq,tr,tt))
 
+# Black-Scholes over arrays
+
+def npdf(n):
+  '''standard normal density, works on arrays
+  '''
+  return np.exp(-0.5*n*n)/(2.0*np.pi)**0.5
+
+def bsarrays(v,s,k,q,r,t,call=True):
+  '''Black-Scholes price and vega for whole arrays of contracts at once:
+       v, s, k, q, r, t = same as bs() above, as arrays or broadcastable scalars
+       call = boolean array (or scalar), True if call, False if put
+     d1, d2 and the discount factors are computed once and shared
+     by the price and the vega. The dividend yield q is carried in d1,
+     so this matches bs() exactly when q = 0.
+     Returns (price, vega) as float arrays.
+  '''
+  v, s, k, q, r, t = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (v,s,k,q,r,t)))
+  call = np.broadcast_to(np.asarray(call,dtype=bool),v.shape)
+
+  sqt = np.sqrt(t)
+  vst = v*sqt
+  with np.errstate(divide='ignore',invalid='ignore'):
+    d1 = (np.log(s/k) + (r - q + 0.5*v*v)*t)/vst
+  d2 = d1 - vst
+  fwd = s*np.exp(-q*t) # dividend-discounted spot
+  pvk = k*np.exp(-r*t)
+
+  price = np.where(call,
+                   ndtr(d1)*fwd - ndtr(d2)*pvk,
+                   ndtr(-d2)*pvk - ndtr(-d1)*fwd)
+  vega = fwd*npdf(d1)*sqt
+  return price, vega
+
+def bsvec(v,s,k,q,r,t,call=True):
+  '''array version of bs(), see bsarrays()
+  '''
+  return bsarrays(v,s,k,q,r,t,call)[0]
+
+def bsvegavec(v,s,k,q,r,t):
+  '''array version of bsvega(), using the normal density, see bsarrays()
+  '''
+  return bsarrays(v,s,k,q,r,t)[1]
+
+# Greeks
+
+def bsgreeks(v,s,k,q,r,t,call=True):
+  '''analytic Black-Scholes Greeks for whole arrays of contracts at once:
+       v, s, k, q, r, t, call = see bsarrays()
+     d1, d2, the densities and the discount factors are computed once
+     and shared by every Greek. Theta is the change in price per year
+     of calendar time (so it is usually negative), vega and rho are per
+     unit of vol and rate (multiply by 0.01 for a point).
+     Returns (price, delta, gamma, theta, vega, rho) as float arrays.
+  '''
+  v, s, k, q, r, t = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (v,s,k,q,r,t)))
+  call = np.broadcast_to(np.asarray(call,dtype=bool),v.shape)
+
+  sqt = np.sqrt(t)
+  vst = v*sqt
+  with np.errstate(divide='ignore',invalid='ignore'):
+    d1 = (np.log(s/k) + (r - q + 0.5*v*v)*t)/vst
+  d2 = d1 - vst
+  fwd = s*np.exp(-q*t)
+  pvk = k*np.exp(-r*t)
+  sign = np.where(call,1.,-1.)
+  nd1 = ndtr(sign*d1)
+  nd2 = ndtr(sign*d2)
+  pdf = npdf(d1)
+
+  price = sign*(nd1*fwd - nd2*pvk)
+  delta = sign*nd1*np.exp(-q*t)
+  vega = fwd*pdf*sqt
+  with np.errstate(divide='ignore',invalid='ignore'):
+    gamma = fwd*pdf/(s*s*vst)
+    theta = -fwd*pdf*v/(2*sqt) + sign*(q*fwd*nd1 - r*pvk*nd2)
+  rho = sign*t*pvk*nd2
+  return price, delta, gamma, theta, vega, rho
+
 # Newton-Raphson
 
-def nr(fx,fpx,x0 = 0.1,e = 0.00001,args = ()):
+def nr(fx,fpx,x0 = 0.1,e = 0.00001,args = (),maxiter = 1000):
   '''Implements Newton-Raphson method
        fx = f(x)
        fpx = f'(x)
        x0 = initial guess
        e = error term
        args = other required arguments
+       maxiter = cap on iterations, raises if it is hit
 
      x0 must be the first argument of the function!
   '''
@@ -77,24 +157,28 @@ def nr(fx,fpx,x0 = 0.1,e = 0.00001,args = ()):
 
   # print(new_result)
 
-  if abs(x0 - new_result) > e:
-    return nr(fx,fpx,new_result,e,args)
-  else:
-    return new_result
+  i = 1
+  while abs(x0 - new_result) > e:
+    if i >= maxiter:
+      raise Exception('Sorry, Newton-Raphson did not converge.')
+    x0 = new_result
+    new_result = x0 - fx(*((x0,)+args))/fpx(*((x0,)+args))
+    i += 1
+  return new_result
 
 # integrating Black-Scholes with Newton-Raphson
 
-def bsvol(v,s,k,q,r,t,p):
+def bsvol(v,s,k,q,r,t,p,call=True):
   '''first order Taylor polynomial of f(vol)
        where f(vol) is the Black-Scholes function with regard to volatility
        and f'(vol) is Black Scholes vega
   '''
-  newvol = (p - bs(v,s,k,q,r,t) + bsvega(v,s,k,q,r,t)*v)/bsvega(v,s,k,q,r,t)
+  newvol = (p - bs(v,s,k,q,r,t,call) + bsvega(v,s,k,q,r,t)*v)/bsvega(v,s,k,q,r,t)
   if newvol < 0 or newvol > 1000:
     raise Exception('Sorry, Black-Scholes broke.')
   return newvol
   
-def nrtest(fx,x0 = 0.1,e = 0.0001,args = ()):
+def nrtest(fx,x0 = 0.1,e = 0.0001,args = (),maxiter = 1000):
   '''modified newton-raphson method for the bsvol() function above
      uses the first order Taylor series
        x_{n+1} = (f(x_{n+1}) - f(x_n) + f'(x_n)*x_n)/f'(x_n)
@@ -102,16 +186,331 @@ def nrtest(fx,x0 = 0.1,e = 0.0001,args = ()):
        fx = function that it takes
        x0 = initial guess
        e = error term
-       counter = tracks recursion, keeps it from going too long
        args = other required arguments
+       maxiter = cap on iterations, raises if it is hit
 
      x0 must be the first argument of the function!
   '''
   new_result = fx(*(x0,) + args)
   # print(new_result)
-  if abs(x0 - new_result) > e:
-    return nrtest(fx,new_result,e,args)
-  else:
-    return new_result
+  i = 1
+  while abs(x0 - new_result) > e:
+    if i >= maxiter:
+      raise Exception('Sorry, Newton-Raphson did not converge.')
+    x0 = new_result
+    new_result = fx(*(x0,) + args)
+    i += 1
+  return new_result
   
-# print('Newton-Raphson Test:',nrtest(bsvol,0.1,0.0001,(ts,tk,tq,tr,tt,tp)))
\ No newline at end of file
+# print('Newton-Raphson Test:',nrtest(bsvol,0.1,0.0001,(ts,tk,tq,tr,tt,tp)))
+
+# Batched Newton-Raphson with a bisection safeguard
+
+'''Status codes returned per contract by bsvolbatch():
+     CONVERGED = the vol moved by less than e on the last step
+     MAXITER = ran out of iterations before converging (the steps kept diverging)
+     NOBRACKET = the price is outside what any vol in [lo, hi] can produce
+     BADINPUT = nan/inf or non-positive inputs
+     VEGAUNDERFLOW = ran out of iterations with vega too small to take Newton steps
+     NOARBITRAGE = rejected by prefilter.check(), never given to a solver
+'''
+
+CONVERGED = 0
+MAXITER = 1
+NOBRACKET = 2
+BADINPUT = 3
+VEGAUNDERFLOW = 4
+NOARBITRAGE = 5
+
+def bsvolbatch(p,s,k,q,r,t,call=True,x0=0.1,e=0.0001,lo=1e-6,hi=10.,maxiter=100,tiny=1e-10):
+  '''implied vol for whole arrays of contracts at once:
+       p = option price
+       s, k, q, r, t, call = see bsarrays()
+       x0 = initial guess, scalar or array
+       e = error term
+       lo, hi = starting bracket for the vol
+       maxiter = cap on iterations
+       tiny = vega below this is treated as zero
+     Every lane takes a Newton step on each iteration. The bracket [lo, hi]
+     is tightened with the sign of the pricing error, and a lane falls back
+     to bisection whenever its vega is tiny or the Newton step leaves the
+     bracket. Lanes retire as soon as they converge.
+     Returns (vol, status, iterations); vol is nan where status != CONVERGED.
+  '''
+  p, s, k, q, r, t, x0 = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (p,s,k,q,r,t,x0)))
+  call = np.broadcast_to(np.asarray(call,dtype=bool),p.shape)
+  shape = p.shape
+  p, s, k, q, r, t, x0, call = (a.ravel() for a in (p,s,k,q,r,t,x0,call))
+
+  vol = np.full(p.shape,np.nan)
+  status = np.full(p.shape,MAXITER,dtype=np.int8)
+  iters = np.zeros(p.shape,dtype=np.int32)
+
+  bad = ~(np.isfinite(p) & np.isfinite(s) & np.isfinite(k) & np.isfinite(q)
+          & np.isfinite(r) & np.isfinite(t) & (s > 0) & (k > 0) & (t > 0) & (p > 0))
+  status[bad] = BADINPUT
+
+  # the price is increasing in vol, so the target has to sit between the ends
+  idx = np.flatnonzero(~bad)
+  plo = bsvec(lo,s[idx],k[idx],q[idx],r[idx],t[idx],call[idx])
+  phi = bsvec(hi,s[idx],k[idx],q[idx],r[idx],t[idx],call[idx])
+  out = (p[idx] < plo) | (p[idx] > phi)
+  status[idx[out]] = NOBRACKET
+  idx = idx[~out]
+
+  a = np.full(idx.shape,lo)
+  b = np.full(idx.shape,hi)
+  x = np.clip(x0[idx],lo,hi)
+  lowvega = np.zeros(idx.shape,dtype=bool)
+
+  for i in range(maxiter):
+    if idx.size == 0:
+      break
+    iters[idx] += 1
+    price, vega = bsarrays(x,s[idx],k[idx],q[idx],r[idx],t[idx],call[idx])
+    f = price - p[idx]
+    a = np.where(f < 0,x,a)
+    b = np.where(f > 0,x,b)
+
+    with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+      newx = x - f/vega
+    lowvega = vega < tiny
+    bisect = lowvega | ~np.isfinite(newx) | (newx <= a) | (newx >= b)
+    newx = np.where(bisect,0.5*(a+b),newx)
+
+    done = (np.abs(newx - x) <= e) | (f == 0)
+    vol[idx[done]] = np.where(f[done] == 0,x[done],newx[done])
+    status[idx[done]] = CONVERGED
+
+    keep = ~done
+    idx, a, b, x, lowvega = idx[keep], a[keep], b[keep], newx[keep], lowvega[keep]
+
+  status[idx[lowvega]] = VEGAUNDERFLOW
+  return vol.reshape(shape), status.reshape(shape), iters.reshape(shape)
+
+# print('Batch Test:',bsvolbatch([tp,tp],ts,tk,tq,tr,tt))
+
+
+# Near-closed-form implied vol, after Jaeckel's "Let's Be Rational" (2015)
+
+'''Everything below works on the normalised Black price of an out-of-the-money call
+     b(x,s) = e^{x/2} N(x/s + s/2) - e^{-x/2} N(x/s - s/2),  x = ln(F/K) <= 0,  s = vol*sqrt(t)
+   A first guess for s comes from rational cubic interpolation between three
+   anchor points around the inflection point s_c = sqrt(2|x|), and from
+   asymptotic maps of the wings, then two Householder steps of order 3 on a
+   transformed objective take it to machine precision.
+'''
+
+def nbcall(x,s):
+  '''normalised Black price of an out-of-the-money call, see above
+     the erfcx form keeps full relative precision in the far wing
+  '''
+  h = x/s
+  t = 0.5*s
+  with np.errstate(over='ignore',invalid='ignore'):
+    far = 0.5*np.exp(-0.5*(h*h+t*t))*(erfcx(-(h+t)/2**0.5) - erfcx(-(h-t)/2**0.5))
+    near = np.exp(0.5*x)*ndtr(h+t) - np.exp(-0.5*x)*ndtr(h-t)
+  return np.where(h+t < -1,far,near)
+
+def nbvega(x,s):
+  '''derivative of nbcall() with respect to s
+  '''
+  h = x/s
+  t = 0.5*s
+  return np.exp(-0.5*(h*h+t*t))/(2.0*np.pi)**0.5
+
+def householder(newton,halley,hh3):
+  '''step factor of a third-order Householder step
+  '''
+  return (1 + 0.5*halley*newton)/(1 + newton*(halley + hh3*newton/6))
+
+def rationalcubic(x,xl,xr,yl,yr,dl,dr,r):
+  '''Delbourgo-Gregory rational cubic interpolation on [xl,xr],
+     a cubic Hermite spline when the control parameter r is 3
+  '''
+  h = xr - xl
+  with np.errstate(divide='ignore',invalid='ignore'):
+    t = np.where(h > 0,(x - xl)/h,0.5)
+  omt = 1 - t
+  t2 = t*t
+  omt2 = omt*omt
+  return (yr*t2*t + (r*yr - h*dr)*t2*omt + (r*yl + h*dl)*t*omt2 + yl*omt2*omt)/(1 + (r - 3)*t*omt)
+
+def rationalcubicmin(dl,dr,slope):
+  '''smallest control parameter that keeps the interpolation monotone and convex/concave
+  '''
+  monotone = (dl*slope >= 0) & (dr*slope >= 0)
+  convex = (dl <= slope) & (slope <= dr)
+  concave = (dl >= slope) & (slope >= dr)
+  with np.errstate(divide='ignore',invalid='ignore'):
+    r1 = np.where(monotone & (slope != 0),(dr + dl)/slope,-np.inf)
+    r2 = np.where((convex | concave) & (slope != dl) & (dr != slope),
+                  np.maximum(np.abs((dr - dl)/(dr - slope)),np.abs((dr - dl)/(slope - dl))),-np.inf)
+  r = np.maximum(r1,r2)
+  return np.where(monotone | convex | concave,np.maximum(r,-(1 - 2**-26)),-(1 - 2**-26))
+
+def rationalcubicfit(xl,xr,yl,yr,dl,dr,d2,left):
+  '''control parameter that matches the second derivative d2 at the left (or right) end,
+     but no smaller than rationalcubicmin()
+  '''
+  h = xr - xl
+  slope = (yr - yl)/h
+  with np.errstate(divide='ignore',invalid='ignore'):
+    if left:
+      r = (0.5*h*d2 + (dr - dl))/(slope - dl)
+    else:
+      r = (0.5*h*d2 + (dr - dl))/(dr - slope)
+  r = np.where(np.isfinite(r),r,1e300)
+  return np.minimum(np.maximum(r,rationalcubicmin(dl,dr,slope)),1e300)
+
+def flower(x,s):
+  '''lower wing map and its first two derivatives with respect to the price
+  '''
+  ax = np.abs(x)
+  z = ax/(3**0.5*s)
+  y = z*z
+  s2 = s*s
+  cdf = ndtr(-z)
+  pdf = npdf(z)
+  with np.errstate(over='ignore',invalid='ignore',divide='ignore'):
+    fpp = np.pi/6*y/(s2*s)*cdf*(8*3**0.5*s*ax + (3*s2*(s2 - 8) - 8*x*x)*cdf/pdf)*np.exp(2*y + 0.25*s2)
+    fp = 2*np.pi*y*cdf*cdf*np.exp(y + 0.125*s2)
+  f = 2*np.pi/27**0.5*ax*cdf**3
+  return f, fp, fpp
+
+def flowerinv(x,f):
+  with np.errstate(divide='ignore',invalid='ignore'):
+    return np.abs(x/(3**0.5*ndtri((f/(2*np.pi/27**0.5*np.abs(x)))**(1/3))))
+
+def fupper(x,s):
+  '''upper wing map and its first two derivatives with respect to the price
+  '''
+  with np.errstate(over='ignore',divide='ignore',invalid='ignore'):
+    w = (x/s)**2
+    fp = -0.5*np.exp(0.5*w)
+    fpp = (np.pi/2)**0.5*np.exp(w + 0.125*s*s)*w/s
+  return ndtr(-0.5*s), fp, fpp
+
+def fupperinv(f):
+  return -2*ndtri(f)
+
+def nbvol(beta,x,steps=2):
+  '''normalised implied vol s of an out-of-the-money call price beta, x <= 0,
+     for prices strictly inside (0, e^{x/2})
+  '''
+  bmax = np.exp(0.5*x)
+  sc = (2*np.abs(x))**0.5
+  bc = nbcall(x,sc)
+  vc = nbvega(x,sc)
+  sl = sc - bc/vc
+  bl = nbcall(x,sl)
+  su = np.where(vc > 0,sc + (bmax - bc)/vc,sc)
+  bu = nbcall(x,su)
+  vl = nbvega(x,sl)
+  vu = nbvega(x,su)
+
+  lower = beta < bl
+  upper = beta > bu
+  middle = ~lower & ~upper
+
+  with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+    # lower wing: interpolate the lower map on [0,b_l], then invert it
+    fl, fpl, fppl = flower(x,sl)
+    rll = rationalcubicfit(0.,bl,0.,fl,1.,fpl,fppl,False)
+    f = rationalcubic(beta,0.,bl,0.,fl,1.,fpl,rll)
+    t = beta/bl
+    f = np.where(f > 0,f,(fl*t + bl*(1 - t))*t)
+    slow = flowerinv(x,f)
+
+    # middle: interpolate s itself on [b_l,b_c] or [b_c,b_u]
+    rlm = rationalcubicfit(bl,bc,sl,sc,1/vl,1/vc,0.,False)
+    rhm = rationalcubicfit(bc,bu,sc,su,1/vc,1/vu,0.,True)
+    smid = np.where(beta <= bc,
+                    rationalcubic(beta,bl,bc,sl,sc,1/vl,1/vc,rlm),
+                    rationalcubic(beta,bc,bu,sc,su,1/vc,1/vu,rhm))
+
+    # upper wing: interpolate the upper map on [b_u,b_max], then invert it
+    fu, fpu, fppu = fupper(x,su)
+    ruu = rationalcubicfit(bu,bmax,fu,0.,fpu,-0.5,fppu,True)
+    f = rationalcubic(beta,bu,bmax,fu,0.,fpu,-0.5,ruu)
+    h = bmax - bu
+    t = (beta - bu)/h
+    f = np.where(f > 0,f,(fu*(1 - t) + 0.5*h*t)*(1 - t))
+    sup = fupperinv(f)
+
+  s = np.where(lower,slow,np.where(upper,sup,smid))
+
+  for i in range(steps):
+    b = nbcall(x,s)
+    bp = nbvega(x,s)
+    h = x/s
+    bhalley = h*h/s - 0.25*s
+    bhh3 = bhalley*bhalley - 3*(h/s)**2 - 0.25
+    with np.errstate(divide='ignore',invalid='ignore',over='ignore'):
+      # lower wing: Householder on 1/ln(b) - 1/ln(beta)
+      lnb = np.log(b)
+      lnbeta = np.log(beta)
+      bpob = bp/b
+      newton = (lnbeta - lnb)*lnb/lnbeta/bpob
+      halley = bhalley - bpob*(1 + 2/lnb)
+      hh3 = bhh3 + 2*bpob*bpob*(1 + 3/lnb*(1 + 1/lnb)) - 3*bhalley*bpob*(1 + 2/lnb)
+      dlow = newton*householder(newton,halley,hh3)
+
+      # middle: Householder on b - beta
+      newton = (beta - b)/bp
+      dmid = np.maximum(-0.5*s,newton*householder(newton,bhalley,bhh3))
+
+      # upper wing: Householder on ln((b_max - beta)/(b_max - b))
+      bmb = bmax - b
+      g = np.log((bmax - beta)/bmb)
+      gp = bp/bmb
+      newton = -g/gp
+      dup = newton*householder(newton,bhalley + gp,bhh3 + gp*(2*gp + 3*bhalley))
+
+    ds = np.where(lower,dlow,np.where(upper,dup,dmid))
+    s = np.where(np.isfinite(ds),s + ds,s)
+  return s
+
+def bsvolrational(p,s,k,q,r,t,call=True,steps=2):
+  '''implied vol for whole arrays of contracts from a rational first guess
+     and a fixed number of high-order corrections, see nbvol():
+       p = option price
+       s, k, q, r, t, call = see bsarrays()
+       steps = Householder steps after the first guess
+     Returns (vol, status, iterations) like bsvolbatch(), so the two are interchangeable.
+  '''
+  p, s, k, q, r, t = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (p,s,k,q,r,t)))
+  shape = p.shape
+  call = np.broadcast_to(np.asarray(call,dtype=bool),shape).ravel()
+  p, s, k, q, r, t = (a.ravel() for a in (p,s,k,q,r,t))
+
+  vol = np.full(p.shape,np.nan)
+  status = np.full(p.shape,CONVERGED,dtype=np.int8)
+  iters = np.zeros(p.shape,dtype=np.int32)
+
+  bad = ~(np.isfinite(p) & np.isfinite(s) & np.isfinite(k) & np.isfinite(q)
+          & np.isfinite(r) & np.isfinite(t) & (s > 0) & (k > 0) & (t > 0) & (p > 0))
+  status[bad] = BADINPUT
+  idx = np.flatnonzero(~bad)
+
+  # normalise: forward, log-moneyness, and the price over the discounted geometric mean of F and K
+  fwd = s[idx]*np.exp((r[idx] - q[idx])*t[idx])
+  x = np.log(fwd/k[idx])
+  beta = p[idx]/(np.exp(-r[idx]*t[idx])*(fwd*k[idx])**0.5)
+  theta = np.where(call[idx],1.,-1.)
+  # an in-the-money option's time value is the out-of-the-money price at -|x|
+  beta = beta - np.maximum(theta*(np.exp(0.5*x) - np.exp(-0.5*x)),0.)
+  x = -np.abs(x)
+
+  out = (beta <= 0) | (beta >= np.exp(0.5*x))
+  status[idx[out]] = NOBRACKET
+  idx, x, beta = idx[~out], x[~out], beta[~out]
+
+  vol[idx] = nbvol(beta,x,steps)/t[idx]**0.5
+  iters[idx] = steps
+  return vol.reshape(shape), status.reshape(shape), iters.reshape(shape)
+
+'''Implied vol engines with the same call signature and return values, by name
+'''
+
+SOLVERS = {'newton':bsvolbatch, 'rational':bsvolrational}
@@ -0,0 +1,102 @@
+'''Columnar ingest of CBOE end-of-day option quotes
+
+   Every daily CSV under the eod-options tree is read with only the columns
+   we need, filtered by option type and moneyness with boolean masks, and the
+   mids, log-moneyness and days to expiry are computed as whole columns.
+
+   The contract table returned by read() and ingest() has one row per contract:
+     quote_date, expiration = datetime64
+     strike, price (option mid), spot (underlying mid), logm (ln(spot/strike)) = float64
+     bid, ask = float64, the option's end-of-day quotes
+     call = bool, True if call, False if put
+     days = int64, trading days from quote date to expiration, both included
+'''
+
+import os, re, numpy as np, pandas as pd, tradingdays as td
+
+COLUMNS = ['quote_date','expiration','strike','option_type',
+           'bid_eod','ask_eod','underlying_bid_eod','underlying_ask_eod']
+
+def filedate(path):
+  '''quote date (YYYY-MM-DD) in a daily file's name, e.g.
+     UnderlyingOptionsEODQuotes_2018-09-04.csv, None if the name has none
+  '''
+  found = re.search(r'(\d{4}-\d{2}-\d{2})',os.path.basename(path))
+  return found.group(1) if found else None
+
+def files(root='eod-options',start=None,end=None):
+  '''every daily CSV under root, in sorted order
+       start, end = YYYY-MM-DD, skip the files dated outside [start, end]
+                    by filedate(), files without a date are always kept
+  '''
+  out = []
+  for dirName, subdirList, fileList in os.walk(root):
+    out += [os.path.join(dirName,f) for f in fileList if f.endswith('.csv')]
+  dated = [(f,filedate(f)) for f in out]
+  return sorted(f for f, date in dated if date is None or ((start is None or date >= start) and (end is None or date <= end)))
+
+def read(path,cpflag=None,moneyness=None,days=None):
+  '''reads one daily CSV into a contract table (see above)
+       path = CSV file
+       cpflag = 'C' or 'P' to keep only calls or puts, None for both
+       moneyness = keep only |strike - spot| < moneyness, None for all
+       days = calendar index from tradingdays.load(), loaded if None
+  '''
+  df = pd.read_csv(path,usecols=COLUMNS)
+  strike = df['strike'].to_numpy(dtype=float)
+  spot = (df['underlying_bid_eod'].to_numpy(dtype=float) + df['underlying_ask_eod'].to_numpy(dtype=float))/2
+  option_type = df['option_type'].to_numpy()
+
+  mask = np.ones(len(df),dtype=bool)
+  if cpflag is not None:
+    mask &= option_type == cpflag
+  if moneyness is not None:
+    mask &= np.abs(strike - spot) < moneyness
+
+  df = df[mask]
+  strike = strike[mask]
+  spot = spot[mask]
+  quote_date = pd.to_datetime(df['quote_date']).to_numpy(dtype='datetime64[D]')
+  expiration = pd.to_datetime(df['expiration']).to_numpy(dtype='datetime64[D]')
+  if days is None:
+    days = td.load()
+
+  bid = df['bid_eod'].to_numpy(dtype=float)
+  ask = df['ask_eod'].to_numpy(dtype=float)
+  return pd.DataFrame({'quote_date':quote_date.astype('datetime64[ns]'),
+                       'expiration':expiration.astype('datetime64[ns]'),
+                       'strike':strike,
+                       'call':option_type[mask] == 'C',
+                       'price':(bid + ask)/2,
+                       'spot':spot,
+                       'logm':np.log(spot/strike),
+                       'days':td.between(days,quote_date,expiration).astype(np.int64),
+                       'bid':bid,
+                       'ask':ask})
+
+def ingest(root='eod-options',cpflag=None,moneyness=None,days=None,progress=lambda x: x):
+  '''reads every daily CSV under root into one contract table
+       root = top of the eod-options tree
+       cpflag, moneyness, days = see read()
+       progress = wrapper for the file list, e.g. tqdm
+  '''
+  if days is None:
+    days = td.load()
+  tables = [read(f,cpflag,moneyness,days) for f in progress(files(root))]
+  if not tables:
+    return empty()
+  return pd.concat(tables,ignore_index=True)
+
+def empty():
+  '''contract table with no rows
+  '''
+  return pd.DataFrame({'quote_date':np.array([],dtype='datetime64[ns]'),
+                       'expiration':np.array([],dtype='datetime64[ns]'),
+                       'strike':np.array([],dtype=float),
+                       'call':np.array([],dtype=bool),
+                       'price':np.array([],dtype=float),
+                       'spot':np.array([],dtype=float),
+                       'logm':np.array([],dtype=float),
+                       'days':np.array([],dtype=np.int64),
+                       'bid':np.array([],dtype=float),
+                       'ask':np.array([],dtype=float)})
@@ -0,0 +1,104 @@
+'''Compact struct-of-arrays container for a chain of option contracts
+
+   Replaces the DataFrames with a (quote date, expiration, strike, C/P)
+   string MultiIndex and positional columns (aapl[5]) that the aaplvol
+   scripts used to build. A Chain keeps one typed NumPy array per field:
+
+     quote_date, expiration = int32, days since 1970-01-01
+     strike, price, spot, logm = float64
+     bid, ask = float32
+     days = int16, trading days to expiry
+     call = bool
+     dividend, dividend_yield, rate = float64, nan until join() is called
+
+   75 bytes per contract, plus 13 for the results, which are allocated up
+   front and filled in place: vol (float64, nan), status (int8, MAXITER
+   until solved) and iterations (int32). The arrays are handed to the pricers and solvers as
+   they are, so nothing is copied or converted per call.
+'''
+
+import numpy as np, pandas as pd, blackscholes as bs, marketdata as md
+
+FIELDS = {'quote_date':np.int32,'expiration':np.int32,
+          'strike':np.float64,'price':np.float64,'spot':np.float64,'logm':np.float64,
+          'bid':np.float32,'ask':np.float32,'days':np.int16,'call':np.bool_,
+          'dividend':np.float64,'dividend_yield':np.float64,'rate':np.float64}
+
+RESULTS = {'vol':np.float64,'status':np.int8,'iterations':np.int32}
+
+class Chain:
+  '''typed arrays of n contracts, see above
+       n = number of contracts, every field is allocated empty
+  '''
+
+  def __init__(self,n=0):
+    for name, dtype in FIELDS.items():
+      setattr(self,name,np.empty(n,dtype=dtype))
+    for name in ('dividend','dividend_yield','rate'):
+      getattr(self,name)[:] = np.nan
+    self.vol = np.full(n,np.nan,dtype=RESULTS['vol'])
+    self.status = np.full(n,bs.MAXITER,dtype=RESULTS['status'])
+    self.iterations = np.zeros(n,dtype=RESULTS['iterations'])
+
+  @classmethod
+  def fromtable(cls,table):
+    '''Chain from a contract table from store.load() or cboe.ingest()
+    '''
+    out = cls(len(table))
+    for name in ('quote_date','expiration'):
+      getattr(out,name)[:] = table[name].to_numpy(dtype='datetime64[D]').astype(np.int64)
+    for name in ('strike','price','spot','logm','days','call'):
+      getattr(out,name)[:] = table[name].to_numpy()
+    for name in ('bid','ask'):
+      getattr(out,name)[:] = table[name].to_numpy() if name in table else np.nan
+    return out
+
+  def __len__(self):
+    return len(self.strike)
+
+  def __getitem__(self,idx):
+    '''the contracts picked by a mask or index array, fields and results alike
+    '''
+    out = Chain.__new__(Chain)
+    for name in list(FIELDS) + list(RESULTS):
+      setattr(out,name,getattr(self,name)[idx])
+    return out
+
+  def __repr__(self):
+    if not len(self):
+      return 'Chain(0 contracts)'
+    dates = self.dates('quote_date')
+    return 'Chain(%d contracts, %s to %s, %d calls, %.0f bytes/contract)' % (
+      len(self),dates.min(),dates.max(),self.call.sum(),self.nbytes()/len(self))
+
+  def nbytes(self):
+    return sum(getattr(self,name).nbytes for name in list(FIELDS) + list(RESULTS))
+
+  def dates(self,name='quote_date'):
+    '''quote_date or expiration as datetime64[D]
+    '''
+    return getattr(self,name).astype('datetime64[D]')
+
+  def join(self,divs,rfr):
+    '''fills dividend, dividend_yield and rate in place, see marketdata.join()
+    '''
+    self.dividend[:], self.dividend_yield[:], self.rate[:] = md.join(self.dates(),self.spot,divs,rfr)
+    return self
+
+  def args(self,model='bs'):
+    '''(p, s, k, q, r, t, call) in the order the solvers take them:
+         bs = dividend yield and t in years, like blackscholes.bsvolbatch()
+         crr = dividend in dollars and t in trading days, like american.crrbatch()
+       Only t is computed, the rest are the chain's own arrays.
+    '''
+    if model == 'bs':
+      return self.price, self.spot, self.strike, self.dividend_yield, self.rate, self.days/252, self.call
+    return self.price, self.spot, self.strike, self.dividend, self.rate, self.days.astype(np.float64), self.call
+
+  def table(self):
+    '''the chain and its results as a DataFrame, for writing out
+    '''
+    out = pd.DataFrame({name:getattr(self,name) for name in list(FIELDS) + list(RESULTS)})
+    for name in ('quote_date','expiration'):
+      out[name] = self.dates(name)
+    return out
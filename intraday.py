@@ -0,0 +1,46 @@
+'''Chunked loader for intraday option quote files like the one aaplvol.py reads
+
+   The tick file is streamed in bounded-size chunks. Timestamps are parsed for
+   the whole chunk at once, bid/ask mids are computed as columns, and each
+   chunk is folded into running sums and counts per resample bucket, so memory
+   depends on the number of buckets, not the size of the file. Buckets start
+   at midnight of the first day in the file, as they do for resample(), so
+   frequencies that do not divide a day (e.g. '7h') give the same buckets.
+'''
+
+import numpy as np, pandas as pd
+
+def load(path,freq='6h',chunksize=1000000,time='Date-Time',bid='Bid Price',ask='Ask Price'):
+  '''mean bid/ask mid per freq bucket, like
+       df.set_index('Date-Time').resample(freq).mean().dropna()
+     on the whole file, but without holding the file in memory:
+       path = CSV of quotes
+       freq = bucket size, a fixed-length pandas offset alias ('6h', '90min', '1D', ...)
+       chunksize = rows read at a time
+       time, bid, ask = column names
+     Returns a DataFrame indexed by 'Date-Time' with one 'Price' column.
+     The file is assumed to be in time order, as tick files are: the first
+     chunk's earliest day is taken as the first day of the file.
+  '''
+  step = pd.Timedelta(freq).to_timedelta64()
+  origin = None
+  sums = pd.Series(dtype=float)
+  counts = pd.Series(dtype=float)
+  for chunk in pd.read_csv(path,usecols=[time,bid,ask],chunksize=chunksize):
+    # UTC datetime64 values, never one Timestamp object per row
+    stamp = pd.to_datetime(chunk[time],utc=True).values
+    ok = ~np.isnat(stamp)
+    if origin is None:
+      if not ok.any():
+        continue
+      origin = stamp[ok].min().astype('datetime64[D]')
+    # buckets as whole steps from origin, grouped as plain int64
+    bucket = (stamp[ok] - origin)//step
+    mid = (chunk[bid].to_numpy(dtype=float) + chunk[ask].to_numpy(dtype=float))/2
+    grouped = pd.Series(mid[ok],index=bucket).dropna().groupby(level=0)
+    sums = sums.add(grouped.sum(),fill_value=0)
+    counts = counts.add(grouped.count(),fill_value=0)
+  price = (sums/counts).sort_index()
+  start = origin if origin is not None else np.datetime64(0,'D')
+  price.index = pd.DatetimeIndex(start + price.index.to_numpy(dtype=np.int64)*step,name=time).tz_localize('UTC')
+  return pd.DataFrame({'Price':price})
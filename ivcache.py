@@ -0,0 +1,100 @@
+'''Persistent implied vol cache keyed by the full solver input
+
+   A key is the model name, step count and tolerance plus the price, spot,
+   strike, dividend, rate, time to expiry and call/put of one contract, so
+   a contract is only solved again when one of those changes. Entries live
+   in an SQLite file, are looked up in bulk for a whole batch, and the least
+   recently used ones are evicted once the cache holds more than maxsize.
+
+   A hit returns what was stored when the contract was solved, iteration
+   counts included, so after each solve() the hit mask is kept in .hit and
+   can be passed to report.Run.solver() as cached, to count only real
+   solver work.
+'''
+
+import sqlite3, numpy as np
+
+PATH = 'ivcache.sqlite'
+
+class IVCache:
+  '''on-disk cache of solver results:
+       path = SQLite file
+       maxsize = number of entries kept, least recently used go first
+  '''
+
+  def __init__(self,path=PATH,maxsize=5000000):
+    self.db = sqlite3.connect(path)
+    self.maxsize = maxsize
+    self.hit = np.zeros(0,dtype=bool)
+    self.db.execute('CREATE TABLE IF NOT EXISTS cache (key BLOB PRIMARY KEY, value BLOB, used INTEGER)')
+    self.db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+    self.tick = self.db.execute('SELECT COALESCE(MAX(used),0) FROM cache').fetchone()[0]
+
+  def close(self):
+    self.db.close()
+
+  def keys(self,model,steps,e,p,s,k,q,r,t,call):
+    '''one bytes key per contract
+    '''
+    p, s, k, q, r, t, call = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (p,s,k,q,r,t,call)))
+    steps = np.broadcast_to(np.asarray(steps,dtype=float),p.shape)
+    rows = np.ascontiguousarray(np.stack([steps,p,s,k,q,r,t,call],axis=-1).reshape(-1,8))
+    prefix = ('%s|%r|' % (model,float(e))).encode()
+    return [prefix + x for x in rows.view('V64').ravel().tolist()]
+
+  def get(self,keys):
+    '''looks up a batch of keys, returns (hit mask, list of stored values or None)
+    '''
+    self.tick += 1
+    self.db.execute('CREATE TEMP TABLE IF NOT EXISTS batch (i INTEGER, key BLOB)')
+    self.db.execute('DELETE FROM batch')
+    self.db.executemany('INSERT INTO batch VALUES (?,?)',enumerate(keys))
+    found = [None]*len(keys)
+    for i, value in self.db.execute('SELECT batch.i, cache.value FROM batch JOIN cache ON cache.key = batch.key'):
+      found[i] = value
+    self.db.execute('UPDATE cache SET used = ? WHERE key IN (SELECT key FROM batch)',(self.tick,))
+    self.db.commit()
+    return np.array([x is not None for x in found],dtype=bool), found
+
+  def put(self,keys,values):
+    '''stores a batch of (key, value) pairs and evicts down to maxsize
+    '''
+    self.tick += 1
+    self.db.executemany('INSERT OR REPLACE INTO cache VALUES (?,?,?)',
+                        ((key,value,self.tick) for key, value in zip(keys,values)))
+    extra = self.db.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.maxsize
+    if extra > 0:
+      self.db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used LIMIT ?)',(extra,))
+    self.db.commit()
+
+  def solve(self,solver,model,steps,e,p,s,k,q,r,t,call=True,extra=()):
+    '''runs solver only on the contracts that miss the cache
+       solver = function of (p,s,k,q,r,t,call) arrays returning a tuple of arrays,
+                like blackscholes.bsvolbatch() or parallel.crrvol()
+       model, steps, e = the rest of the key, e.g. ('crr',100,0.0001)
+       extra = more per-contract arrays that are not part of the key,
+               passed to solver after call (e.g. warm-start guesses)
+     Returns the solver's tuple of arrays for every contract, and sets .hit
+     to the mask of the contracts that came from the cache.
+    '''
+    p, s, k, q, r, t = (np.ravel(x) for x in np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (p,s,k,q,r,t))))
+    call = np.broadcast_to(np.asarray(call,dtype=bool),p.shape)
+    keys = self.keys(model,steps,e,p,s,k,q,r,t,call)
+    hit, found = self.get(keys)
+    self.hit = hit
+    miss = np.flatnonzero(~hit)
+
+    solved = solver(p[miss],s[miss],k[miss],q[miss],r[miss],t[miss],call[miss],
+                    *(np.broadcast_to(x,p.shape)[miss] for x in extra))
+    out = [np.empty(p.shape,dtype=x.dtype) for x in solved]
+    if hit.any():
+      cached = np.frombuffer(b''.join(x for x in found if x is not None),dtype=float).reshape(-1,len(out))
+      for j, x in enumerate(out):
+        x[hit] = cached[:,j]
+    for x, y in zip(out,solved):
+      x[miss] = y
+
+    if miss.size:
+      rows = np.stack([np.asarray(y,dtype=float) for y in solved],axis=-1)
+      self.put([keys[i] for i in miss],[row.tobytes() for row in rows])
+    return tuple(out)
@@ -0,0 +1,216 @@
+'''Non-interactive batch entry point for the implied volatility pipeline
+
+   Does what aaplvol2.py (Black-Scholes) and aaplvol3.py (Cox-Ross-Rubenstein) do,
+   but takes its settings from the command line or a JSON config file instead of
+   input() prompts, so it can be scheduled:
+
+     python ivrun.py --model crr --type c --moneyness 50 --steps 100 --start 2018-09-04 --headless
+     python ivrun.py --config nightly.json --pull
+
+   Settings in the config file use the long option names (e.g. {"model": "bs",
+   "moneyness": 1}), and options given on the command line win. Plotting and the
+   market calendar are only imported when they are used, and --headless skips
+   the plots altogether and only writes the results.
+'''
+
+import sys, json, argparse, numpy as np
+import blackscholes as bs, american as am, tradingdays as td, store, ivcache, warmstart, surface, prefilter, pipeline, report, marketdata as md
+
+DEFAULTS = {'model':'bs','type':'c','moneyness':None,'steps':100,'lattice':'crr','tol':None,'engine':'newton',
+            'start':None,'end':None,'workers':None,'pull':False,'headless':False,
+            'eod':'eod-options','store':'aapl-store','surface':None,'dividends':'aapl-dividends.csv','rates':'FRB_H15.csv',
+            'out':None,'report':None,'progress':False,'greeks':False,
+            'stream':False,'readers':2,'depth':4}
+
+def parse(argv=None):
+  '''settings from the defaults, then the config file, then the command line
+  '''
+  parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('--config',help='JSON file of settings, by long option name')
+  parser.add_argument('--model',choices=['bs','crr'],help='bs = Black-Scholes, crr = Cox-Ross-Rubenstein')
+  parser.add_argument('--type',choices=['c','p'],help='calls or puts')
+  parser.add_argument('--moneyness',type=float,help='keep |strike - spot| < moneyness')
+  parser.add_argument('--steps',type=int,help='steps in the CRR tree')
+  parser.add_argument('--lattice',choices=am.LATTICES,help='binomial tree for --model crr, see american.LATTICES')
+  parser.add_argument('--tol',type=float,help='solver tolerance on the vol (bs 0.001, crr 0.0001 by default)')
+  parser.add_argument('--engine',choices=sorted(bs.SOLVERS),help='Black-Scholes implied vol engine')
+  parser.add_argument('--start',help='first quote date, YYYY-MM-DD')
+  parser.add_argument('--end',help='last quote date, YYYY-MM-DD')
+  parser.add_argument('--workers',type=int,help='CRR worker processes, 1 to solve in this process')
+  parser.add_argument('--pull',action='store_true',default=None,help='ingest new daily files into the store first')
+  parser.add_argument('--headless',action='store_true',default=None,help='write results only, no plots')
+  parser.add_argument('--progress',action='store_true',default=None,help='show a progress bar while ingesting')
+  parser.add_argument('--stream',action='store_true',default=None,
+                      help='read and solve the eod-options tree as a pipeline, writing results as they come (no store, no plots)')
+  parser.add_argument('--readers',type=int,help='reader processes for --stream')
+  parser.add_argument('--depth',type=int,help='daily files read ahead for --stream, the solvers keep max(depth, workers) in flight')
+  parser.add_argument('--greeks',action='store_true',default=None,help='add delta, gamma, theta, vega and rho at the solved vols')
+  parser.add_argument('--eod',help='eod-options tree')
+  parser.add_argument('--store',help='contract store directory')
+  parser.add_argument('--surface',help='implied vol surface file, updated with the solved vols, ivsurface-<model>[-<lattice>].npz by default')
+  parser.add_argument('--dividends',help='dividend CSV')
+  parser.add_argument('--rates',help='risk-free rate CSV')
+  parser.add_argument('--out',help='results CSV, ivresults-<model>.csv by default')
+  parser.add_argument('--report',help='run report JSON, ivrun-<model>-report.json by default')
+  args = vars(parser.parse_args(argv))
+
+  settings = dict(DEFAULTS)
+  path = args.pop('config')
+  if path:
+    with open(path) as f:
+      config = json.load(f)
+    unknown = set(config) - set(DEFAULTS)
+    if unknown:
+      parser.error('unknown settings in config file: ' + ', '.join(sorted(unknown)))
+    settings.update(config)
+  settings.update({k:v for k, v in args.items() if v is not None})
+  if settings['tol'] is None:
+    settings['tol'] = 0.001 if settings['model'] == 'bs' else 0.0001
+  return settings
+
+def solve(settings,contracts,q,y,r,run):
+  '''implied vols of the contract table, returns (vol, status, iterations)
+       q, y, r = dividend in dollars, dividend yield and rate, see marketdata.join()
+     Contracts that fail prefilter.check() are not solved and get a nan vol and status NOARBITRAGE.
+  '''
+  p = contracts['price'].to_numpy(dtype=float)
+  s = contracts['spot'].to_numpy(dtype=float)
+  k = contracts['strike'].to_numpy(dtype=float)
+  days = contracts['days'].to_numpy(dtype=float)
+  call = contracts['call'].to_numpy()
+  bid = contracts['bid'].to_numpy(dtype=float)
+  ask = contracts['ask'].to_numpy(dtype=float)
+  if settings['model'] == 'bs':
+    reason = prefilter.check(p,s,k,y,r,days/252,call,bid,ask,'bs')
+  else:
+    reason = prefilter.check(p,s,k,q,r,days,call,bid,ask,'crr')
+  run.check(settings['model'],reason)
+  n = len(p)
+  ok = np.flatnonzero(reason == prefilter.OK)
+  contracts = contracts.iloc[ok]
+  p, s, k, days, call, q, y, r = (x[ok] for x in (p,s,k,days,call,q,y,r))
+
+  exp = contracts['expiration'].to_numpy(dtype='datetime64[D]')
+  tol = settings['tol']
+  cache = ivcache.IVCache()
+  # one surface per model, see surface.py
+  kind = 'bs' if settings['model'] == 'bs' else 'crr' if settings['lattice'] == 'crr' else 'crr-' + settings['lattice']
+  surfpath = settings['surface'] or 'ivsurface-%s.npz' % kind
+  surf = surface.load(surfpath)
+  date = contracts['quote_date'].to_numpy(dtype='datetime64[D]')
+  logm = contracts['logm'].to_numpy(dtype=float)
+  # contracts the warm start has never seen start from the surface instead
+  smile = surface.vol(surf,days/252,logm,date)
+  fromsurf = lambda x0, found: (np.where(found | np.isnan(smile),x0,smile),found | np.isfinite(smile))
+
+  if settings['model'] == 'bs':
+    q = y
+    hist = warmstart.load('warmstart-bs.npz')
+    x0, found = fromsurf(*warmstart.guess(hist,exp,k,call,default=1))
+    engine = settings['engine']
+    solver = (lambda *x: bs.bsvolbatch(*x,e=tol)) if engine == 'newton' else (lambda *x: bs.SOLVERS[engine](*x[:7]))
+    vol, status, iters = cache.solve(solver,'bs-' + engine,0,tol,p,s,k,q,r,days/252,call,extra=(x0,))
+    good = status == bs.CONVERGED
+    run.solver('bs-' + engine,iters,status,bs.bsvec(vol,s,k,q,r,days/252,call) - p,cached=cache.hit)
+    warmstart.save(warmstart.update(hist,exp,k,call,vol,good),'warmstart-bs.npz')
+  else:
+    steps = settings['steps']
+    lattice = settings['lattice']
+    name = 'crr' if lattice == 'crr' else 'crr-' + lattice
+    hist = warmstart.load('warmstart-crr.npz')
+    x0, found = fromsurf(*warmstart.guess(hist,exp,k,call))
+    vol, iters = cache.solve(lambda *x: warmstart.crrvol(*x,steps=steps,a0=0,b0=3,e=tol,workers=settings['workers'],
+                                                        lattice=lattice),
+                             name,steps,tol,p,s,k,q,r,days,call,extra=(x0,found))
+    residual = am.crrbatch(vol,steps,s,k,q,r,days,call,lattice) - p
+    status = report.itpstatus(vol,iters,residual=residual)
+    run.solver(name,iters,status,residual,cached=cache.hit)
+    warmstart.save(warmstart.update(hist,exp,k,call,vol,status == bs.CONVERGED),'warmstart-crr.npz')
+  cache.close()
+  surface.save(surface.update(surf,date,days/252,logm,np.where(status == bs.CONVERGED,vol,np.nan)),surfpath)
+
+  out = (np.full(n,np.nan),np.full(n,bs.NOARBITRAGE,dtype=np.int8),np.zeros(n,dtype=iters.dtype))
+  for x, solved in zip(out,(vol,status,iters)):
+    x[ok] = solved
+  return out
+
+GREEKS = pipeline.GREEKS
+
+def greeks(settings,contracts,q,y,r,vol):
+  '''Greeks at the solved vols, as a dict of columns (nan where vol is nan),
+     see pipeline.greeks()
+  '''
+  s = contracts['spot'].to_numpy(dtype=float)
+  k = contracts['strike'].to_numpy(dtype=float)
+  days = contracts['days'].to_numpy(dtype=float)
+  call = contracts['call'].to_numpy()
+  if settings['model'] == 'bs':
+    return pipeline.greeks('bs',vol,settings['steps'],s,k,y,r,days/252,call)
+  return pipeline.greeks('crr',vol,settings['steps'],s,k,q,r,days,call)
+
+def plot(settings,results):
+  '''the charts of aaplvol2.py and aaplvol3.py, binned so they cost the same for any number of contracts
+  '''
+  import matplotlib
+  matplotlib.use('Agg')
+  import plots
+  good = results[results['status'] == bs.CONVERGED]
+  name = 'ivrun-%s' % settings['model']
+  plots.density(good['logm'],good['vol'],name + '-2d1.png','ln(spot/strike)','Implied Vol')
+  plots.density(good['days'],good['vol'],name + '-2d2.png','time to expiry','Implied Vol')
+  plots.heatmap(good['days'],good['logm'],good['vol'],name + '-heat.png','time to expiry','ln(spot/strike)','Implied Vol')
+
+def main(argv=None):
+  settings = parse(argv)
+  model = settings['model']
+  run = report.Run('ivrun-' + model)
+
+  run.mark('calendar')
+  days = td.load()
+
+  if settings['stream']:
+    progress = lambda x: x
+    if settings['progress']:
+      from tqdm import tqdm as progress
+    run.mark('pipeline')
+    pipeline.run(settings['out'] or 'ivresults-%s.csv' % model,settings['eod'],model,settings['type'].upper(),
+                 settings['moneyness'],days,settings['dividends'],settings['rates'],settings['steps'],settings['tol'],
+                 settings['engine'],settings['readers'],settings['workers'],settings['depth'],run,progress,
+                 settings['lattice'],settings['start'],settings['end'],settings['greeks'])
+    out = run.save(settings['report'] or 'ivrun-%s-report.json' % model)
+    print(json.dumps(out['solvers'],indent=2))
+    return 0
+
+  run.mark('ingest')
+  if settings['pull']:
+    progress = lambda x: x
+    if settings['progress']:
+      from tqdm import tqdm as progress
+    store.update(settings['store'],settings['eod'],days,progress)
+  contracts = store.load(settings['store'],settings['start'],settings['end'],
+                         settings['type'].upper(),settings['moneyness'])
+
+  run.mark('market data')
+  q, y, r = md.join(contracts['quote_date'],contracts['spot'],md.dividends(settings['dividends']),md.rates(settings['rates']))
+
+  run.mark('solve')
+  vol, status, iters = solve(settings,contracts,q,y,r,run)
+
+  results = contracts.assign(dividend=q,dividend_yield=y,rate=r,vol=vol,status=status,iterations=iters)
+  if settings['greeks']:
+    run.mark('greeks')
+    results = results.assign(**greeks(settings,contracts,q,y,r,np.where(status == bs.CONVERGED,vol,np.nan)))
+
+  run.mark('write')
+  results.to_csv(settings['out'] or 'ivresults-%s.csv' % model,index=False)
+
+  if not settings['headless']:
+    run.mark('plot')
+    plot(settings,results)
+
+  out = run.save(settings['report'] or 'ivrun-%s-report.json' % model)
+  print(json.dumps(out['solvers'],indent=2))
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
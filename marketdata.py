@@ -0,0 +1,51 @@
+'''Dividend and risk-free rate data, joined onto whole contract tables
+
+   aapl-dividends.csv (Seeking Alpha, one row per quarterly dividend, 'Pay Date'
+   as MM-DD-YYYY and 'Amount' in dollars) and FRB_H15.csv (4-week T-Bill 'Rate'
+   in percent by 'Date') are each loaded once into sorted arrays. join() then
+   attaches, with one as-of lookup per column:
+     dividend = the last dividend paid on or before the quote date, in dollars
+     yield = that dividend as an annualised yield on the spot, (1 + D/S)^4 - 1
+     rate = the last published rate on or before the quote date, as a decimal
+   This is the one definition both the Black-Scholes and the CRR pipelines use.
+'''
+
+import numpy as np, pandas as pd
+
+def dividends(path='aapl-dividends.csv'):
+  '''(pay dates as datetime64[D], amounts) sorted by pay date
+  '''
+  df = pd.read_csv(path)
+  date = pd.to_datetime(df['Pay Date'],format='%m-%d-%Y').to_numpy(dtype='datetime64[D]')
+  amount = pd.to_numeric(df['Amount'],errors='coerce').to_numpy(dtype=float)
+  order = np.argsort(date,kind='stable')
+  keep = np.isfinite(amount[order])
+  return date[order][keep], amount[order][keep]
+
+def rates(path='FRB_H15.csv'):
+  '''(dates as datetime64[D], rates as decimals) sorted by date,
+     with missing days (e.g. 'ND' or blanks) forward filled
+  '''
+  df = pd.read_csv(path)
+  date = pd.to_datetime(df['Date']).to_numpy(dtype='datetime64[D]')
+  rate = pd.to_numeric(df['Rate'],errors='coerce').to_numpy(dtype=float)*0.01
+  order = np.argsort(date,kind='stable')
+  return date[order], pd.Series(rate[order]).ffill().to_numpy()
+
+def asof(dates,values,when):
+  '''the value at the last date on or before each of when, nan before the first date
+  '''
+  i = np.searchsorted(dates,np.asarray(when,dtype='datetime64[D]'),side='right') - 1
+  return np.where(i >= 0,values[np.maximum(i,0)] if len(values) else np.nan,np.nan)
+
+def join(quote_date,spot,divs,rfr):
+  '''dividend, annualised dividend yield and rate for every contract
+       quote_date = array of quote dates
+       spot = array of underlying prices
+       divs = output of dividends()
+       rfr = output of rates()
+     Returns (dividend, yield, rate) arrays.
+  '''
+  quote_date = np.asarray(quote_date,dtype='datetime64[D]')
+  dividend = asof(*divs,quote_date)
+  return dividend, (1 + dividend/np.asarray(spot,dtype=float))**4 - 1, asof(*rfr,quote_date)
@@ -0,0 +1,58 @@
+'''Process-pool execution of the American implied vol computation
+
+   The contract arrays are split into contiguous chunks, each chunk is solved
+   with american.itpbatch() over american.crrbatch() in a worker process, and
+   the results are put back together in the original order. Only NumPy arrays
+   travel between processes, never DataFrame rows.
+'''
+
+import os, functools, multiprocessing as mp, numpy as np, american as am
+from concurrent.futures import ProcessPoolExecutor
+
+# the aaplvol scripts run at module level, so workers are forked where possible
+# instead of spawned (a spawned worker would re-run the script's prompts)
+
+context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else None
+
+def solvechunk(p,s,k,q,r,t,call,steps,a0,b0,e,lattice='crr'):
+  '''solves one chunk, runs in a worker process, with each lane's lower
+     bracket raised to american.minvol() so that no root is sought where the
+     tree is not arbitrage-free
+  '''
+  a0 = np.maximum(a0,am.minvol(steps,r,t,lattice)*1.000001)
+  b0 = np.maximum(b0,a0)
+  return am.itpbatch(functools.partial(am.crrbatch,model=lattice),p,a0,b0,e=e,args=(steps,s,k,q,r,t,call))
+
+def crrvol(p,s,k,q,r,t,call=True,steps=100,a0=0,b0=3,e=0.0001,workers=None,chunk=2048,lattice='crr'):
+  '''American implied vol for whole arrays of contracts, solved in parallel
+       p = option price
+       s, k, q, r, t, call = see american.crr()
+       steps = number of steps in the tree, scalar or array
+       a0, b0, e = see american.itpbatch(), a0 and b0 may be arrays
+       workers = number of worker processes, os.cpu_count() if None,
+                 1 solves in this process
+       chunk = contracts per task, smaller chunks balance the load better
+       lattice = tree to price with, see american.LATTICES
+     Returns (vol, k) arrays, like american.itpbatch().
+  '''
+  p, s, k, q, r, t, steps, a0, b0 = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (p,s,k,q,r,t,steps,a0,b0)))
+  shape = p.shape
+  call = np.broadcast_to(np.asarray(call,dtype=bool),shape).ravel()
+  steps = steps.ravel().astype(int)
+  p, s, k, q, r, t, a0, b0 = (a.ravel() for a in (p,s,k,q,r,t,a0,b0))
+  workers = workers or os.cpu_count() or 1
+
+  if workers == 1 or p.size <= chunk:
+    vol, iters = solvechunk(p,s,k,q,r,t,call,steps,a0,b0,e,lattice)
+    return vol.reshape(shape), iters.reshape(shape)
+
+  bounds = range(0,p.size,chunk)
+  with ProcessPoolExecutor(max_workers=workers,mp_context=context) as pool:
+    futures = [pool.submit(solvechunk,p[i:i+chunk],s[i:i+chunk],k[i:i+chunk],q[i:i+chunk],
+                           r[i:i+chunk],t[i:i+chunk],call[i:i+chunk],steps[i:i+chunk],
+                           a0[i:i+chunk],b0[i:i+chunk],e,lattice)
+               for i in bounds]
+    results = [f.result() for f in futures]
+  vol = np.concatenate([x[0] for x in results])
+  iters = np.concatenate([x[1] for x in results])
+  return vol.reshape(shape), iters.reshape(shape)
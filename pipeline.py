@@ -0,0 +1,156 @@
+'''Pipelined ingest and solve of the eod-options tree
+
+   Reading a multi-year tree one CSV at a time and only then solving leaves
+   the CPUs idle while the disk is busy and the other way round. Here the
+   two overlap:
+
+     daily CSVs -> reader processes (cboe.read)
+                -> main process (market data join, prefilter.check)
+                -> solver processes (Black-Scholes or CRR implied vols, Greeks)
+                -> results CSV, appended one quote date at a time
+
+   The results have the same columns and values as those of ivrun.py without
+   --stream: contracts that fail the prefilter get a nan vol and status
+   NOARBITRAGE, and the residuals go to the run report.
+
+   The reader stage keeps at most depth tasks submitted and not yet consumed,
+   and the solver stage at most max(depth, solvers), so every solver process
+   has a quote date to work on. A fast stage waits for a slow one instead of
+   piling up tables in memory, and memory stays bounded however many years
+   the tree covers. Results come out in file order.
+'''
+
+import os, collections, numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import blackscholes as bs, american as am, tradingdays as td, cboe, prefilter, parallel, report, marketdata as md
+
+GREEKS = ['delta','gamma','theta','vega','rho']
+
+def ahead(pool,fn,tasks,depth):
+  '''runs fn(*args) on pool for each (key, args) in tasks, keeping at most depth
+     running or waiting to be consumed, and yields (key, result) in task order
+  '''
+  pending = collections.deque()
+  for key, args in tasks:
+    pending.append((key,pool.submit(fn,*args)))
+    if len(pending) >= depth:
+      key, future = pending.popleft()
+      yield key, future.result()
+  while pending:
+    key, future = pending.popleft()
+    yield key, future.result()
+
+def greeks(model,vol,steps,s,k,q,r,t,call):
+  '''Greeks at the solved vols as a dict of columns, nan where vol is nan
+       model, s, k, q, r, t, call = see solvebatch()
+       steps = steps in the tree for 'crr'
+  '''
+  if model == 'bs':
+    out = bs.bsgreeks(vol,s,k,q,r,t,call)
+  else:
+    out = am.crrgreeks(vol,steps,s,k,q,r,t,call)
+  return dict(zip(GREEKS,out[1:]))
+
+def solvebatch(model,p,s,k,q,r,t,call,steps=100,tol=0.0001,engine='newton',lattice='crr',withgreeks=False):
+  '''implied vols of one batch, runs in a solver process
+       model = 'bs' (q = yield, t in years) or 'crr' (q in dollars, t in days)
+       lattice = tree for 'crr', see american.LATTICES
+       withgreeks = also compute greeks() at the converged vols
+     Returns (vol, status, iterations, residual, Greek columns or {}),
+     residual = model price at vol minus p.
+  '''
+  if model == 'bs':
+    if engine == 'newton':
+      vol, status, iters = bs.bsvolbatch(p,s,k,q,r,t,call,e=tol)
+    else:
+      vol, status, iters = bs.SOLVERS[engine](p,s,k,q,r,t,call)
+    residual = bs.bsvec(vol,s,k,q,r,t,call) - p
+  else:
+    vol, iters = parallel.solvechunk(p,s,k,q,r,t,call,steps,0,3,tol,lattice)
+    residual = am.crrbatch(vol,steps,s,k,q,r,t,call,lattice) - p
+    status = report.itpstatus(vol,iters,residual=residual)
+  cols = dict()
+  if withgreeks:
+    cols = greeks(model,np.where(status == bs.CONVERGED,vol,np.nan),steps,s,k,q,r,t,call)
+  return vol, status, iters, residual, cols
+
+def prepare(table,model,divs,rfr,start=None,end=None):
+  '''market data and prefilter for one contract table,
+     returns (table with the market data, solver arguments of the feasible rows)
+       start, end = YYYY-MM-DD, drop the quote dates outside [start, end]
+  '''
+  date = table['quote_date'].dt.strftime('%Y-%m-%d').to_numpy()
+  mask = np.ones(len(table),dtype=bool)
+  if start is not None:
+    mask &= date >= start
+  if end is not None:
+    mask &= date <= end
+  table = table[mask]
+  q, y, r = md.join(table['quote_date'],table['spot'],divs,rfr)
+  table = table.assign(dividend=q,dividend_yield=y,rate=r)
+  p, s, k, call = (table[c].to_numpy() for c in ('price','spot','strike','call'))
+  days = table['days'].to_numpy(dtype=float)
+  if model == 'bs':
+    args = (p,s,k,y,r,days/252,call)
+  else:
+    args = (p,s,k,q,r,days,call)
+  reason = prefilter.check(*args,bid=table['bid'],ask=table['ask'],model=model)
+  ok = reason == prefilter.OK
+  return table, reason, tuple(x[ok] for x in args)
+
+def run(out,root='eod-options',model='bs',cpflag=None,moneyness=None,days=None,
+        dividends='aapl-dividends.csv',rates='FRB_H15.csv',steps=100,tol=None,engine='newton',
+        readers=2,solvers=None,depth=4,log=None,progress=lambda x: x,lattice='crr',
+        start=None,end=None,withgreeks=False):
+  '''reads, solves and writes every daily CSV under root
+       out = results CSV, replaced
+       root, cpflag, moneyness, days = see cboe.ingest()
+       start, end = YYYY-MM-DD, first and last quote dates, None for no bound
+       withgreeks = add the GREEKS columns at the converged vols
+       model, steps, tol, engine, lattice = see ivrun.py
+       dividends, rates = market data CSVs, see marketdata.py
+       readers, solvers = processes for each stage, solvers = os.cpu_count() if None
+       depth = reader tasks in flight, the solvers keep max(depth, solvers) in flight,
+               so memory is bounded by about depth + max(depth, solvers) daily tables
+       log = report.Run to record the solver statistics in, optional
+       progress = wrapper for the file list, e.g. tqdm
+     Returns the number of contracts written.
+  '''
+  if days is None:
+    days = td.load()
+  if tol is None:
+    tol = 0.001 if model == 'bs' else 0.0001
+  divs, rfr = md.dividends(dividends), md.rates(rates)
+  name = 'bs-' + engine if model == 'bs' else 'crr' if lattice == 'crr' else 'crr-' + lattice
+  if os.path.exists(out):
+    os.remove(out)
+
+  solvers = solvers or os.cpu_count() or 1
+
+  written = 0
+  header = True
+  with ProcessPoolExecutor(max_workers=readers,mp_context=parallel.context) as readpool, \
+       ProcessPoolExecutor(max_workers=solvers,mp_context=parallel.context) as solvepool:
+    files = progress(cboe.files(root,start,end))
+    tables = ahead(readpool,cboe.read,((f,(f,cpflag,moneyness,days)) for f in files),depth)
+    batches = (prepare(table,model,divs,rfr,start,end) for f, table in tables)
+    solved = ahead(solvepool,solvebatch,(((table,reason),(model,) + args + (steps,tol,engine,lattice,withgreeks))
+                                         for table, reason, args in batches),max(depth,solvers))
+    for (table, reason), (vol, status, iters, residual, cols) in solved:
+      ok = reason == prefilter.OK
+      if log is not None:
+        log.check(model,reason)
+        log.solver(name,iters,status,residual)
+      allvol = np.full(len(table),np.nan)
+      allstatus = np.full(len(table),bs.NOARBITRAGE,dtype=np.int8)
+      alliters = np.zeros(len(table),dtype=np.int32)
+      allvol[ok], allstatus[ok], alliters[ok] = vol, status, iters
+      table = table.assign(vol=allvol,status=allstatus,iterations=alliters)
+      for col, x in cols.items():
+        allcol = np.full(len(table),np.nan)
+        allcol[ok] = x
+        table[col] = allcol
+      table.to_csv(out,mode='a',header=header,index=False)
+      header = False
+      written += len(table)
+  return written
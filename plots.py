@@ -0,0 +1,81 @@
+'''Plots of implied vol that stay cheap however many contracts there are
+
+   Instead of one marker (or one triangle) per contract, points are binned
+   first and only the bins are drawn:
+     density() = hexbin of how many contracts fall in each cell
+     heatmap() = mean of z over a rectangular grid of x and y
+     surface3d() = the same gridded means drawn as a 3-D surface
+   The number of bins is fixed by gridsize/bins, so drawing time and memory
+   do not grow with the input, and binning is a single pass over the arrays.
+'''
+
+import numpy as np, matplotlib.pyplot as plt
+from mpl_toolkits.mplot3d import axes3d
+
+def finite(*arrays):
+  '''the arrays as floats, keeping only the points that are finite in all of them
+  '''
+  arrays = [np.asarray(x,dtype=float).ravel() for x in arrays]
+  keep = np.logical_and.reduce([np.isfinite(x) for x in arrays])
+  return [x[keep] for x in arrays]
+
+def gridmean(x,y,z,bins=40):
+  '''mean of z over a bins x bins grid of (x, y), in one pass
+     Returns (x centres, y centres, mean, count), mean is nan in empty cells
+     and mean/count are indexed [x bin, y bin].
+  '''
+  x, y, z = finite(x,y,z)
+  count, xe, ye = np.histogram2d(x,y,bins=bins)
+  total = np.histogram2d(x,y,bins=(xe,ye),weights=z)[0]
+  with np.errstate(divide='ignore',invalid='ignore'):
+    mean = np.where(count > 0,total/count,np.nan)
+  return 0.5*(xe[1:]+xe[:-1]), 0.5*(ye[1:]+ye[:-1]), mean, count
+
+def density(x,y,path,xlabel,ylabel,title=None,gridsize=80):
+  '''hexbin of the number of contracts at each (x, y), on a log colour scale
+  '''
+  x, y = finite(x,y)
+  fig, ax = plt.subplots()
+  if len(x):
+    cells = ax.hexbin(x,y,gridsize=gridsize,bins='log',mincnt=1,cmap='viridis')
+    fig.colorbar(cells,ax=ax,label='contracts')
+  ax.set_xlabel(xlabel)
+  ax.set_ylabel(ylabel)
+  if title:
+    ax.set_title(title)
+  fig.savefig(path)
+  plt.close(fig)
+
+def heatmap(x,y,z,path,xlabel,ylabel,zlabel,title=None,bins=40):
+  '''mean of z on a grid of (x, y), see gridmean()
+  '''
+  xc, yc, mean, count = gridmean(x,y,z,bins)
+  fig, ax = plt.subplots()
+  mesh = ax.pcolormesh(xc,yc,mean.T,shading='nearest',cmap='viridis')
+  fig.colorbar(mesh,ax=ax,label=zlabel)
+  ax.set_xlabel(xlabel)
+  ax.set_ylabel(ylabel)
+  if title:
+    ax.set_title(title)
+  fig.savefig(path)
+  plt.close(fig)
+
+def surface3d(x,y,z,path,xlabel,ylabel,zlabel,title=None,bins=40):
+  '''3-D surface through the non-empty cells of gridmean(),
+     at most bins^2 points whatever the size of x, y and z
+  '''
+  xc, yc, mean, count = gridmean(x,y,z,bins)
+  gx, gy = np.meshgrid(xc,yc,indexing='ij')
+  keep = count > 0
+  fig = plt.figure()
+  ax = plt.axes(projection='3d')
+  # Delaunay needs the cells to span both axes
+  if len(np.unique(gx[keep])) > 1 and len(np.unique(gy[keep])) > 1:
+    ax.plot_trisurf(gx[keep],gy[keep],mean[keep],cmap='viridis',edgecolor='none',linewidth=0,antialiased=True)
+  ax.set_xlabel(xlabel)
+  ax.set_ylabel(ylabel)
+  ax.set_zlabel(zlabel)
+  if title:
+    plt.title(title)
+  fig.savefig(path)
+  plt.close(fig)
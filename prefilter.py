@@ -0,0 +1,87 @@
+'''No-arbitrage checks between ingest and the implied vol solvers
+
+   A quote outside the model's price bounds has no implied vol at all, so
+   there is no point handing it to a solver: Newton burns its iterations and
+   ITP its bracket on it. check() tags every contract with a reason code,
+   and only the OK ones should be solved.
+
+   Bounds, with D = discount factor and Q = the dividend-discounted spot:
+     European (model='bs', q = dividend yield, t in years, r continuous)
+       call: max(Q - K*D, 0) <= C <= Q
+       put:  max(K*D - Q, 0) <= P <= K*D
+     American (model='crr', q = dividend in dollars per quarter, t in trading
+     days, r annually compounded, as in american.crr())
+       call: max(S - K, S - q*m - K*D, 0) <= C <= S
+       put:  max(K - S, K*D - S, 0) <= P <= K
+     where m is the number of dividends before expiry (every 62.5 trading
+     days, like the tree). Quotes with no bid, or a bid above the ask, are
+     rejected when the bid and ask are known.
+'''
+
+import numpy as np
+
+OK = 0
+BADINPUT = 1
+NOBID = 2
+CROSSED = 3
+BELOWLOWER = 4
+ABOVEUPPER = 5
+
+REASONS = {OK:'ok',
+           BADINPUT:'bad input',
+           NOBID:'no bid',
+           CROSSED:'crossed quote',
+           BELOWLOWER:'below lower bound',
+           ABOVEUPPER:'above upper bound'}
+
+def bounds(s,k,q,r,t,call=True,model='bs'):
+  '''(lower, upper) no-arbitrage price bounds, see above
+  '''
+  s, k, q, r, t = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (s,k,q,r,t)))
+  call = np.broadcast_to(np.asarray(call,dtype=bool),s.shape)
+  if model == 'bs':
+    disc = np.exp(-r*t)
+    fwd = s*np.exp(-q*t)
+    lower = np.maximum(np.where(call,fwd - k*disc,k*disc - fwd),0)
+    upper = np.where(call,fwd,k*disc)
+  elif model == 'crr':
+    disc = (1+r)**(-t/252)
+    pvdiv = q*(t//62.5)
+    lower = np.where(call,np.maximum(s - k,s - pvdiv - k*disc),np.maximum(k - s,k*disc - s))
+    lower = np.maximum(lower,0)
+    upper = np.where(call,s,k)
+  else:
+    raise ValueError('unknown model %r' % model)
+  return lower, upper
+
+def check(p,s,k,q,r,t,call=True,bid=None,ask=None,model='bs',tol=0.):
+  '''reason code for every contract, OK where a vol can exist
+       p, s, k, q, r, t, call = price and contract terms, as the model takes them
+       bid, ask = quotes, skipped where nan or when None
+       model = 'bs' or 'crr', see above
+       tol = slack on the price bounds, in dollars; a price on a bound
+             is rejected, since only a zero or infinite vol reaches it
+     Later checks do not overwrite an earlier reason, so each contract gets the
+     first one that fails, in the order of the codes above.
+  '''
+  p, s, k, q, r, t = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (p,s,k,q,r,t)))
+  call = np.broadcast_to(np.asarray(call,dtype=bool),p.shape)
+  reason = np.full(p.shape,OK,dtype=np.int8)
+  tag = lambda mask, code: np.copyto(reason,code,where=mask & (reason == OK))
+
+  tag(~(np.isfinite(p) & np.isfinite(s) & np.isfinite(k) & np.isfinite(q) & np.isfinite(r) & np.isfinite(t))
+      | (p <= 0) | (s <= 0) | (k <= 0) | (t <= 0),BADINPUT)
+  if bid is not None and ask is not None:
+    bid, ask = np.broadcast_arrays(*(np.asarray(x,dtype=float) for x in (bid,ask,p)))[:2]
+    tag(bid <= 0,NOBID)
+    tag(bid > ask,CROSSED)
+  with np.errstate(invalid='ignore'):
+    lower, upper = bounds(s,k,q,r,t,call,model)
+    tag(p <= lower - tol,BELOWLOWER)
+    tag(p >= upper + tol,ABOVEUPPER)
+  return reason
+
+def counts(reason):
+  '''number of contracts per reason, by name
+  '''
+  return {REASONS.get(int(c),str(int(c))):int(n) for c, n in zip(*np.unique(reason,return_counts=True))}
@@ -0,0 +1,159 @@
+'''Run instrumentation and a structured JSON run report
+
+   A Run records the wall time of each pipeline stage (ingest, market-data
+   join, solve, plot, ...) and, for every contract a solver saw, the number of
+   iterations, the outcome and the final pricing residual. save() writes a
+   JSON summary plus an .npz with the per-contract arrays next to it.
+
+     run = report.Run('aaplvol3')
+     with run.stage('ingest'):
+       ...
+     run.mark('solve')    # or mark the start of each stage in a script,
+     ...                  # which also ends the stage before it
+     run.mark()
+     run.solver('crr',iterations,status,residual,cached=cache.hit)
+     run.save('aaplvol3-report.json')
+
+   With profile=True (or AAPLVOL_PROFILE=1 in the environment) every stage is
+   also run under cProfile and its stats are dumped to <report>-<stage>.prof.
+'''
+
+import os, json, time, cProfile, contextlib, numpy as np, blackscholes as bs, prefilter
+
+'''Outcome names, by the status codes of blackscholes.bsvolbatch()
+'''
+
+REASONS = {bs.CONVERGED:'converged',
+           bs.MAXITER:'diverged',
+           bs.NOBRACKET:'out of bracket',
+           bs.BADINPUT:'bad input',
+           bs.VEGAUNDERFLOW:'vega underflow',
+           bs.NOARBITRAGE:'no-arbitrage reject'}
+
+def itpstatus(vol,iterations,kmax=35,residual=None,ptol=0.05):
+  '''status codes for american.itpbatch() results: a zero vol means no root
+     in the bracket, and hitting kmax means the bracket never closed
+       residual = model price at vol minus the target, optional
+       ptol = largest |residual| (in dollars) a root can have, far above what
+              a bracket 2e wide moves the price, a lane above it settled on a
+              sign change that is not a root and gets no root in the bracket
+  '''
+  status = np.where(vol == 0,bs.NOBRACKET,bs.CONVERGED)
+  if residual is not None:
+    status = np.where(~(np.abs(residual) <= ptol),bs.NOBRACKET,status)
+  return np.where((status == bs.CONVERGED) & (iterations >= kmax),bs.MAXITER,status).astype(np.int8)
+
+class Run:
+  '''timings and solver statistics of one run
+       name = name of the run, e.g. the script
+       profile = run every stage under cProfile
+  '''
+
+  def __init__(self,name,profile=None):
+    self.name = name
+    self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+    self.stages = []
+    self.solvers = dict()
+    self.checks = dict()
+    self.cached = dict()
+    self.profile = bool(os.environ.get('AAPLVOL_PROFILE')) if profile is None else profile
+    self.profiles = dict()
+    self.current = None
+
+  def mark(self,name=None):
+    '''ends the current stage, if any, and starts stage name, if given
+    '''
+    if self.current is not None:
+      stage, start, prof = self.current
+      if prof:
+        prof.disable()
+        self.profiles[stage] = prof
+      self.stages.append({'stage':stage,'seconds':time.perf_counter() - start})
+      self.current = None
+    if name is not None:
+      prof = cProfile.Profile() if self.profile else None
+      self.current = (name,time.perf_counter(),prof)
+      if prof:
+        prof.enable()
+
+  @contextlib.contextmanager
+  def stage(self,name):
+    '''times the body of a with block as one stage
+    '''
+    self.mark(name)
+    try:
+      yield
+    finally:
+      self.mark()
+
+  def solver(self,name,iterations,status,residual=None,cached=None):
+    '''records the per-contract results of one solver call
+       iterations, status = arrays as returned by the solvers
+       residual = model price at the solved vol minus the market price
+       cached = mask of the contracts taken from ivcache.IVCache instead of
+                solved, they count as cache hits with 0 iterations
+    '''
+    iterations = np.asarray(iterations)
+    if cached is not None:
+      cached = np.asarray(cached,dtype=bool)
+      iterations = np.where(cached,0,iterations)
+      self.cached[name] = self.cached.get(name,0) + int(cached.sum())
+    status = np.asarray(status)
+    residual = np.full(status.shape,np.nan) if residual is None else np.asarray(residual,dtype=float)
+    old = self.solvers.get(name)
+    if old is not None:
+      iterations = np.concatenate([old[0],iterations])
+      status = np.concatenate([old[1],status])
+      residual = np.concatenate([old[2],residual])
+    self.solvers[name] = (iterations,status,residual)
+
+  def check(self,name,reason):
+    '''records the reason codes of one prefilter.check() call
+    '''
+    reason = np.asarray(reason)
+    old = self.checks.get(name)
+    self.checks[name] = reason if old is None else np.concatenate([old,reason])
+
+  def summary(self):
+    '''the report as a dict
+    '''
+    out = {'run':self.name,'started':self.started,'stages':self.stages,
+           'total_seconds':sum(x['seconds'] for x in self.stages),'solvers':dict(),
+           'prefilter':{name:prefilter.counts(reason) for name, reason in self.checks.items()}}
+    for name, (iterations,status,residual) in self.solvers.items():
+      ok = status == bs.CONVERGED
+      res = np.abs(residual[ok & np.isfinite(residual)])
+      out['solvers'][name] = {
+        'contracts':int(status.size),
+        'cache_hits':self.cached.get(name,0),
+        'outcomes':{REASONS.get(int(c),str(int(c))):int(n) for c, n in zip(*np.unique(status,return_counts=True))},
+        'iterations':{'total':int(iterations.sum()),
+                      'mean':float(iterations.mean()) if iterations.size else 0.,
+                      'p50':float(np.percentile(iterations,50)) if iterations.size else 0.,
+                      'p99':float(np.percentile(iterations,99)) if iterations.size else 0.,
+                      'max':int(iterations.max()) if iterations.size else 0},
+        'abs_residual':{'p50':float(np.percentile(res,50)) if res.size else None,
+                        'max':float(res.max()) if res.size else None}}
+    return out
+
+  def save(self,path):
+    '''writes the JSON report to path, the per-contract arrays to the same
+       name with .npz, and any cProfile stats to <name>-<stage>.prof
+    '''
+    self.mark()
+    base = os.path.splitext(path)[0]
+    out = self.summary()
+    if self.solvers:
+      arrays = dict()
+      for name, (iterations,status,residual) in self.solvers.items():
+        arrays[name + '_iterations'] = iterations
+        arrays[name + '_status'] = status
+        arrays[name + '_residual'] = residual
+      np.savez(base + '.npz',**arrays)
+      out['contracts_file'] = base + '.npz'
+    for name, prof in self.profiles.items():
+      prof.dump_stats('%s-%s.prof' % (base,name))
+    out['profiles'] = ['%s-%s.prof' % (base,name) for name in self.profiles]
+    with open(path,'w') as f:
+      json.dump(out,f,indent=2)
+    return out
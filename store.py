@@ -0,0 +1,141 @@
+'''Incremental on-disk contract store
+
+   Replaces the aapl.csv snapshot. Contract tables from cboe.read() are kept
+   under one directory per quote date, one .npy file per column, so a
+   partition loads without parsing any text and can be memory-mapped:
+
+     aapl-store/
+       ingested.json        daily CSVs already ingested, by their path under
+                            the eod-options tree, with their size and mtime
+       2018-09-04/
+         expiration.npy     datetime64[D]
+         strike.npy         float64
+         call.npy           bool
+         ...
+         source.npy         str, the daily CSV each row came from
+
+   update() only reads daily files that are not in ingested.json yet,
+   so the daily job touches one new file instead of the whole tree.
+   Ingesting a file replaces the rows it wrote before, so a file that
+   changed, or a tree given by another path ('./eod-options', an absolute
+   path), never duplicates rows.
+'''
+
+import os, json, shutil, numpy as np, pandas as pd, cboe
+
+PATH = 'aapl-store'
+MANIFEST = 'ingested.json'
+COLUMNS = ['expiration','strike','call','price','spot','logm','days','bid','ask']
+
+def manifest(path=PATH):
+  '''dict of the daily files already ingested: file -> [size, mtime]
+  '''
+  try:
+    with open(os.path.join(path,MANIFEST)) as f:
+      return json.load(f)
+  except FileNotFoundError:
+    return dict()
+
+def dates(path=PATH):
+  '''sorted quote dates (YYYY-MM-DD) that have a partition in the store
+  '''
+  if not os.path.isdir(path):
+    return []
+  return sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path,d)) and not d.startswith('.'))
+
+def sources(path,date):
+  '''daily CSV of every row of a partition, None for partitions written
+     before the sources were kept
+  '''
+  f = os.path.join(path,date,'source.npy')
+  return np.load(f) if os.path.exists(f) else None
+
+def write(path,date,table,source=''):
+  '''writes the contracts of one quote date from the daily CSV source,
+     replacing the rows source wrote to the partition before and keeping
+     those of other files (a partition with no sources is replaced whole)
+  '''
+  part = os.path.join(path,date)
+  src = np.full(len(table),source)
+  old = sources(path,date) if os.path.isdir(part) else None
+  if old is not None:
+    keep = old != source
+    table = pd.concat([read(path,date,mmap=False)[keep],table],ignore_index=True)
+    src = np.concatenate([old[keep],src])
+  tmp = os.path.join(path,'.' + date)
+  shutil.rmtree(tmp,ignore_errors=True)
+  os.makedirs(tmp)
+  for col in COLUMNS:
+    x = table[col].to_numpy()
+    if col == 'expiration':
+      x = x.astype('datetime64[D]')
+    np.save(os.path.join(tmp,col + '.npy'),x)
+  np.save(os.path.join(tmp,'source.npy'),src)
+  shutil.rmtree(part,ignore_errors=True)
+  os.rename(tmp,part)
+
+def read(path,date,mmap=True):
+  '''contract table of one quote date, with memory-mapped columns if mmap
+  '''
+  part = os.path.join(path,date)
+  cols = {col:np.load(os.path.join(part,col + '.npy'),mmap_mode='r' if mmap else None) for col in COLUMNS
+          if os.path.exists(os.path.join(part,col + '.npy'))}
+  # partitions written before the quotes were kept have no bid/ask
+  for col in ('bid','ask'):
+    if col not in cols:
+      cols[col] = np.full(len(cols['strike']),np.nan)
+  table = pd.DataFrame({'quote_date':np.full(len(cols['strike']),np.datetime64(date,'ns'))})
+  for col in COLUMNS:
+    table[col] = cols[col].astype('datetime64[ns]') if col == 'expiration' else cols[col]
+  return table[['quote_date'] + COLUMNS]
+
+def update(path=PATH,root='eod-options',days=None,progress=lambda x: x):
+  '''ingests the daily CSVs under root that are new or changed since the last run
+       path = store directory
+       root = top of the eod-options tree
+       days = calendar index from tradingdays.load()
+       progress = wrapper for the list of new files, e.g. tqdm
+     Returns the list of files ingested.
+  '''
+  os.makedirs(path,exist_ok=True)
+  done = manifest(path)
+  new = []
+  # keyed by the path under root, so the same tree given another way matches
+  name = lambda f: os.path.relpath(f,root).replace(os.sep,'/')
+  for f in cboe.files(root):
+    stat = os.stat(f)
+    if done.get(name(f)) != [stat.st_size,stat.st_mtime]:
+      new.append(f)
+
+  for f in progress(new):
+    table = cboe.read(f,days=days)
+    for date, part in table.groupby(table['quote_date'].dt.strftime('%Y-%m-%d')):
+      write(path,date,part,name(f))
+    stat = os.stat(f)
+    done[name(f)] = [stat.st_size,stat.st_mtime]
+    with open(os.path.join(path,MANIFEST + '.tmp'),'w') as out:
+      json.dump(done,out,indent=0)
+    os.replace(os.path.join(path,MANIFEST + '.tmp'),os.path.join(path,MANIFEST))
+  return new
+
+def load(path=PATH,start=None,end=None,cpflag=None,moneyness=None,mmap=True):
+  '''contract table for the quote dates from start to end (both included)
+       start, end = YYYY-MM-DD, None for no bound
+       cpflag = 'C' or 'P' to keep only calls or puts, None for both
+       moneyness = keep only |strike - spot| < moneyness, None for all
+       mmap = memory-map the column files instead of reading them
+  '''
+  tables = []
+  for date in dates(path):
+    if (start is not None and date < start) or (end is not None and date > end):
+      continue
+    table = read(path,date,mmap)
+    mask = np.ones(len(table),dtype=bool)
+    if cpflag is not None:
+      mask &= table['call'].to_numpy() == (cpflag == 'C')
+    if moneyness is not None:
+      mask &= np.abs(table['strike'].to_numpy() - table['spot'].to_numpy()) < moneyness
+    tables.append(table[mask])
+  if not tables:
+    return cboe.empty()
+  return pd.concat(tables,ignore_index=True)
@@ -0,0 +1,126 @@
+'''Implied volatility surface, built up one quote date at a time
+
+   Each quote date's solved vols are fitted, expiry by expiry, with a quadratic
+   smile in total variance w = vol^2 * t over log-moneyness k = ln(spot/strike):
+     w(k) = a + b*k + c*k^2
+   and only the coefficients are kept, one row per (quote date, expiry). The
+   surface at any (t, k) interpolates w linearly in t between the two nearest
+   expiries of that date, and holds the vol flat outside the fitted range of
+   k and beyond the first and last expiries.
+
+   The surface is kept on disk like the warm-start history, and a new run only
+   refits the quote dates it solved, so it grows with the store. Each model
+   keeps its own file (ivsurface-bs.npz, ivsurface-crr.npz, ivsurface-crr-lr.npz,
+   ...), since update() replaces a quote date's slices and the models' vols differ.
+'''
+
+import os, numpy as np
+
+PATH = 'ivsurface.npz'
+
+FIELDS = {'date':'datetime64[D]','t':float,'a':float,'b':float,'c':float,'lo':float,'hi':float,'n':np.int64}
+
+def empty():
+  return {f:np.array([],dtype=d) for f, d in FIELDS.items()}
+
+def load(path=PATH):
+  '''smile coefficients: dict of arrays, one row per (date, t), sorted by date then t
+  '''
+  if not os.path.exists(path):
+    return empty()
+  with np.load(path) as f:
+    return {x:f[x] for x in FIELDS}
+
+def save(surf,path=PATH):
+  np.savez(path,**surf)
+
+def fit(quote_date,t,k,vol,minpoints=3):
+  '''fits one smile per (quote date, t) to the points with a positive vol
+       quote_date, t, k, vol = arrays, t in years and k = ln(spot/strike)
+       minpoints = fewest points for the quadratic, smaller slices get a flat smile
+     All the slices are fitted at once from per-slice sums of k^j and w*k^j.
+     Returns a surface dict with just these slices.
+  '''
+  quote_date, t, k, vol = np.broadcast_arrays(np.asarray(quote_date,dtype='datetime64[D]'),
+                                              *(np.asarray(x,dtype=float) for x in (t,k,vol)))
+  good = np.isfinite(t) & np.isfinite(k) & np.isfinite(vol) & (vol > 0) & (t > 0)
+  quote_date, t, k, vol = quote_date[good], t[good], k[good], vol[good]
+  if not len(t):
+    return empty()
+
+  key, inv = np.unique(np.rec.fromarrays([quote_date.astype(np.int64),t]),return_inverse=True)
+  w = vol*vol*t
+  m = len(key)
+  sums = lambda x: np.bincount(inv,weights=x,minlength=m)
+  kp = [np.ones(len(k)),k,k*k,k**3,k**4]
+  s = [sums(x) for x in kp]
+  y = [sums(w*x) for x in kp[:3]]
+
+  a = y[0]/s[0]
+  b = np.zeros(m)
+  c = np.zeros(m)
+  A = np.stack([np.stack(s[i:i+3],axis=-1) for i in range(3)],axis=-2)
+  Y = np.stack(y,axis=-1)
+  det = np.linalg.det(A)
+  quad = (s[0] >= minpoints) & (np.abs(det) > 1e-12*np.abs(s[4])**1.5)
+  if quad.any():
+    coef = np.linalg.solve(A[quad],Y[quad][...,None])[...,0]
+    a[quad], b[quad], c[quad] = coef.T
+
+  lo = np.full(m,np.inf)
+  hi = np.full(m,-np.inf)
+  np.minimum.at(lo,inv,k)
+  np.maximum.at(hi,inv,k)
+  return {'date':key['f0'].astype('datetime64[D]'),'t':key['f1'],'a':a,'b':b,'c':c,'lo':lo,'hi':hi,
+          'n':s[0].astype(np.int64)}
+
+def update(surf,quote_date,t,k,vol,minpoints=3):
+  '''refits the quote dates in this batch and merges them into the surface,
+     replacing any slices those dates already had
+  '''
+  new = fit(quote_date,t,k,vol,minpoints)
+  keep = ~np.isin(surf['date'],np.unique(np.asarray(quote_date,dtype='datetime64[D]')))
+  out = {f:np.concatenate([surf[f][keep],new[f]]) for f in FIELDS}
+  order = np.lexsort((out['t'],out['date']))
+  return {f:x[order] for f, x in out.items()}
+
+def variance(surf,i,k):
+  '''total variance of slice i (an index array) at k, flat in vol outside the fitted k
+  '''
+  k = np.clip(k,surf['lo'][i],surf['hi'][i])
+  return np.maximum(surf['a'][i] + surf['b'][i]*k + surf['c'][i]*k*k,0)
+
+def vol(surf,t,k,date=None):
+  '''implied vol at arrays of (t, k) points
+       t, k = arrays, t in years and k = ln(spot/strike)
+       date = quote date of the surface to read (scalar or array like t);
+              the latest date on or before it is used, the latest date overall if None
+     nan where there is no surface on or before the date.
+  '''
+  dates = np.unique(surf['date'])
+  when = np.asarray(dates[-1] if date is None and len(dates) else date,dtype='datetime64[D]')
+  t, k, when = np.broadcast_arrays(np.asarray(t,dtype=float),np.asarray(k,dtype=float),when)
+  shape = t.shape
+  t, k, when = t.ravel(), k.ravel(), when.ravel()
+  out = np.full(t.shape,np.nan)
+  if not len(dates):
+    return out.reshape(shape)
+  pick = np.searchsorted(dates,when,side='right') - 1
+
+  for j in np.unique(pick[pick >= 0]):
+    idx = np.flatnonzero(pick == j)
+    first, last = np.searchsorted(surf['date'],dates[j],side='left'), np.searchsorted(surf['date'],dates[j],side='right')
+    ts = surf['t'][first:last]
+    ti, ki = t[idx], k[idx]
+    # neighbouring expiries, clamped to the ends so the vol is flat beyond them
+    hi = np.clip(np.searchsorted(ts,ti),0,len(ts)-1)
+    lo = np.clip(hi-1,0,len(ts)-1)
+    wlo = variance(surf,first+lo,ki)/ts[lo]
+    whi = variance(surf,first+hi,ki)/ts[hi]
+    # interpolate w linearly in t, i.e. the variance rate with weights t_i/t
+    span = ts[hi] - ts[lo]
+    with np.errstate(divide='ignore',invalid='ignore'):
+      x = np.where(span > 0,(ti - ts[lo])/span,0)
+      w = np.where((ti > ts[lo]) & (ti < ts[hi]),(1-x)*wlo*ts[lo] + x*whi*ts[hi],np.where(ti <= ts[0],wlo*ti,whi*ti))
+      out[idx] = np.sqrt(np.maximum(w,0)/ti)
+  return out.reshape(shape)
@@ -0,0 +1,47 @@
+'''Trading-day calendar index for counting days to expiry
+
+   Asking pandas_market_calendars for the NYSE sessions between two dates
+   once per contract dominates ingest time, so instead the sessions are
+   pulled once, kept as a sorted array of dates (saved to disk together
+   with the span it was built for), and
+   counted with searchsorted for whole arrays of (quote date, expiration).
+'''
+
+import os, numpy as np
+
+# default span of the index, covers the rate data (2015 to 2020) with room to spare
+
+START = '2010-01-01'
+END = '2030-12-31'
+PATH = 'nyse-days.npz'
+
+def build(start=START,end=END):
+  '''sorted array of NYSE session dates (datetime64[D]) from start to end
+  '''
+  import pandas_market_calendars as mcal
+  days = mcal.get_calendar('NYSE').valid_days(start_date=start,end_date=end)
+  return np.asarray(days.tz_localize(None).values,dtype='datetime64[D]')
+
+def load(path=PATH,start=START,end=END):
+  '''loads the calendar index from path, building and saving it first
+     if the file is missing or was built for a span that does not cover [start, end]
+  '''
+  # the span is kept next to the sessions because the first and last sessions
+  # can fall inside it (2010-01-01 is a holiday), so they cannot tell coverage
+  if os.path.exists(path):
+    with np.load(path) as saved:
+      if saved['start'] <= np.datetime64(start,'D') and saved['end'] >= np.datetime64(end,'D'):
+        return saved['days']
+  days = build(start,end)
+  np.savez(path,days=days,start=np.datetime64(start,'D'),end=np.datetime64(end,'D'))
+  return days
+
+def between(days,start,end):
+  '''number of sessions in days from start to end, both included,
+     the same count as len(nyse.valid_days(start_date=start,end_date=end))
+       days = calendar index from load()
+       start, end = dates (strings, datetime64 or arrays of them)
+  '''
+  start = np.asarray(start,dtype='datetime64[D]')
+  end = np.asarray(end,dtype='datetime64[D]')
+  return np.searchsorted(days,end,side='right') - np.searchsorted(days,start,side='left')
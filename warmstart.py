@@ -0,0 +1,70 @@
+'''Warm-start implied vol from the previous session's solved vols
+
+   The last solved vol of every (expiration, strike, call/put) is kept on disk.
+   On the next run it is the Newton starting point for Black-Scholes, and the
+   centre of a tight ITP bracket for CRR. Contracts with no history, and CRR
+   contracts whose root falls outside the tight bracket, use the defaults.
+'''
+
+import os, numpy as np, parallel
+
+PATH = 'warmstart.npz'
+
+def keys(expiration,strike,call):
+  '''one int64 key per (expiration, strike, call/put)
+  '''
+  days = np.asarray(expiration,dtype='datetime64[D]').astype(np.int64)
+  milli = np.round(np.asarray(strike,dtype=float)*1000).astype(np.int64)
+  return (days << 33) | (milli << 1) | np.asarray(call,dtype=np.int64)
+
+def load(path=PATH):
+  '''history of solved vols: dict with sorted 'key' and matching 'vol' arrays
+  '''
+  if not os.path.exists(path):
+    return {'key':np.array([],dtype=np.int64),'vol':np.array([],dtype=float)}
+  with np.load(path) as f:
+    return {'key':f['key'],'vol':f['vol']}
+
+def save(hist,path=PATH):
+  np.savez(path,key=hist['key'],vol=hist['vol'])
+
+def guess(hist,expiration,strike,call,default=0.1):
+  '''last solved vol of each contract, default where there is none
+     Returns (x0, found).
+  '''
+  key = keys(expiration,strike,call)
+  i = np.minimum(np.searchsorted(hist['key'],key),max(len(hist['key'])-1,0))
+  found = (hist['key'][i] == key) if len(hist['key']) else np.zeros(key.shape,dtype=bool)
+  x0 = np.where(found,hist['vol'][i] if len(hist['key']) else default,default)
+  return x0, found
+
+def bracket(x0,found,a0=0,b0=3,width=0.2,pad=0.01):
+  '''ITP bracket [a,b]: x0 +/- width*x0 + pad where found, [a0,b0] elsewhere
+  '''
+  a = np.where(found,np.maximum(a0,x0*(1-width) - pad),a0)
+  b = np.where(found,np.minimum(b0,x0*(1+width) + pad),b0)
+  return a, b
+
+def update(hist,expiration,strike,call,vol,good):
+  '''merges the vols solved in this run (where good) into the history,
+     the contracts should be in quote date order so the latest one wins
+  '''
+  key = np.concatenate([hist['key'],keys(expiration,strike,call)[good]])
+  vol = np.concatenate([hist['vol'],np.asarray(vol,dtype=float)[good]])
+  # keep the last occurrence of each key
+  last = len(key) - 1 - np.unique(key[::-1],return_index=True)[1]
+  return {'key':key[last],'vol':vol[last]}
+
+def crrvol(p,s,k,q,r,t,call,x0,found,a0=0,b0=3,width=0.2,**kwargs):
+  '''parallel.crrvol() over tight brackets around x0 where found,
+     then again over [a0,b0] for the lanes whose root was not in the tight bracket
+       kwargs = passed on to parallel.crrvol(), e.g. steps, e, workers
+  '''
+  a, b = bracket(x0,found,a0,b0,width)
+  vol, iters = parallel.crrvol(p,s,k,q,r,t,call,a0=a,b0=b,**kwargs)
+  redo = np.flatnonzero(np.asarray(found) & (vol == 0))
+  if redo.size:
+    pick = lambda x: np.broadcast_to(x,vol.shape)[redo]
+    vol[redo], more = parallel.crrvol(*(pick(x) for x in (p,s,k,q,r,t,call)),a0=a0,b0=b0,**kwargs)
+    iters[redo] += more
+  return vol, iters